@@ -0,0 +1,273 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from bitwarden import BitwardenClient, BitwardenCliCancelledError
+from cli_probe import CACHE_DIR, CliProbeCache
+from frecency import FrecencyStore, boost
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_ACCOUNT = "default"
+
+ACCOUNTS_DIR = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "ulauncher-bitwarden", "accounts"
+)
+
+AccountProfile = namedtuple("AccountProfile", ["name", "email", "server"])
+
+AccountResult = namedtuple("AccountResult", ["account", "entry"])
+
+# Details of this many of the most used entries are fetched after unlock
+FRECENT_WARM_COUNT = 5
+
+ACCOUNT_NAME_RE = re.compile(r"^[\w.-]+$")
+
+
+class AccountMatches:
+    """
+    The ScoredMatches of a search in every account, merged into one ranking
+    as far as asked for. Ties are broken by shorter names, then by account.
+    """
+
+    def __init__(self, matches):
+        self.matches = matches
+        self.total = sum(m.total for _, m in matches)
+
+    def top(self, limit):
+        """ The `limit` best matches as AccountResult, best first """
+        scored = [(-score, len(entry.name), order, AccountResult(name, entry))
+                  for order, (name, matches) in enumerate(self.matches)
+                  for score, entry in matches.top(limit)]
+        scored.sort(key=lambda r: r[:3])
+        return [r[3] for r in scored[:limit]]
+
+
+class RankedResults:
+    """ Results that are already ranked, with the interface of AccountMatches """
+
+    def __init__(self, results):
+        self.results = results
+        self.total = len(results)
+
+    def top(self, limit):
+        return self.results[:limit]
+
+
+def parse_accounts(value):
+    """
+    Parse the additional accounts preference, e.g.
+    "work,alice@example.com,https://vault.example.com; home,alice@example.org,https://vault.bitwarden.com".
+    Malformed profiles are skipped.
+    """
+    profiles = []
+    names = {PRIMARY_ACCOUNT}
+    for spec in (value or "").split(";"):
+        if not spec.strip():
+            continue
+        parts = [p.strip() for p in spec.split(",")]
+        if len(parts) != 3 or not all(parts) or not ACCOUNT_NAME_RE.match(parts[0]) or parts[0] in names:
+            logger.warning("Ignoring account profile %r", spec.strip())
+            continue
+        names.add(parts[0])
+        profiles.append(AccountProfile(*parts))
+    return profiles
+
+
+class AccountManager:
+    """
+    The primary account, configured by the server url and e-mail
+    preferences, and any additional account profiles. Every additional
+    account has a client with its own CLI data directory, so that each has
+    its own login and session.
+
+    Searches fan out to all unlocked accounts in parallel and the results
+    are merged by score, so a query takes about as long as the slowest
+    account.
+
+    Uses of entries are recorded in a FrecencyStore shared by all accounts.
+    Frequently and recently used entries get a ranking boost.
+    """
+
+    def __init__(self, primary, frecency=None):
+        self.primary = primary
+        self.lock = threading.Lock()
+        self.profiles = OrderedDict()
+        self.clients = OrderedDict([(PRIMARY_ACCOUNT, primary)])
+        self.executor = None
+        # Pool threads searching on behalf of a query thread, to cancel their CLI processes too
+        self.helper_threads = dict()
+        self.frecency = frecency or FrecencyStore()
+
+    def configure(self, value):
+        """ Apply the additional accounts preference. Accounts no longer configured are locked. """
+        profiles = OrderedDict((p.name, p) for p in parse_accounts(value))
+        removed = []
+        with self.lock:
+            clients = OrderedDict([(PRIMARY_ACCOUNT, self.primary)])
+            for name, profile in profiles.items():
+                client = self.clients.get(name)
+                if client is None or self.profiles.get(name) != profile:
+                    if client is not None:
+                        removed.append(client)
+                    client = BitwardenClient(
+                        appdata_dir=os.path.join(ACCOUNTS_DIR, name),
+                        probe_cache=CliProbeCache(os.path.join(CACHE_DIR, "cli-{}.json".format(name))),
+                        stats=self.primary.stats,
+                        lock_listeners=self.primary.lock_listeners,
+                    )
+                clients[name] = client
+            removed.extend(c for n, c in self.clients.items() if n not in clients)
+            self.profiles = profiles
+            self.clients = clients
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=len(clients)) if len(clients) > 1 else None
+        for client in removed:
+            self.forget(client)
+
+    @staticmethod
+    def forget(client):
+        client.clear_secrets()
+        client.stop_serve()
+
+    def initialize(self, mfa_enabled, inactivity_lock_timeout, serve_enabled, native_enabled):
+        """ Initialize the additional accounts, the primary one is initialized by the caller """
+        for name, client in self.additional():
+            profile = self.profiles[name]
+            client.initialize(profile.server, profile.email, mfa_enabled, inactivity_lock_timeout, "",
+                              serve_enabled, native_enabled)
+
+    def get(self, name):
+        with self.lock:
+            return self.clients.get(name or PRIMARY_ACCOUNT)
+
+    def all(self):
+        with self.lock:
+            return list(self.clients.items())
+
+    def additional(self):
+        return [(name, client) for name, client in self.all() if name != PRIMARY_ACCOUNT]
+
+    def has_additional(self):
+        return len(self.all()) > 1
+
+    def unlocked(self):
+        return [(name, client) for name, client in self.all() if client.has_session()]
+
+    def locked(self):
+        return [name for name, client in self.all() if not client.has_session()]
+
+    def search(self, query):
+        """ Search all unlocked accounts, returns their AccountMatches """
+        return self.fan_out(lambda name, client: client.match_scored(query, self.boosts(name, client)))
+
+    def search_site(self, site):
+        """ Logins matching the site in all unlocked accounts, like search() """
+        return self.fan_out(lambda name, client: client.match_site(site, self.boosts(name, client)))
+
+    def record_use(self, name, item_id):
+        self.frecency.record(name or PRIMARY_ACCOUNT, item_id)
+
+    def positions(self, name, index):
+        """
+        Map the frecency keys of the items of an index to their positions.
+        Hashing every item id takes a moment, so the map is kept on the index
+        and goes away with it when the vault is locked.
+        """
+        positions = index.frecency_positions
+        if positions is None:
+            keys = self.frecency.keys(name, [entry.id for entry in index.items])
+            positions = index.frecency_positions = dict(zip(keys, range(len(keys))))
+        return positions
+
+    def boosts(self, name, client):
+        """ Ranking boosts of the used items of an account as {position in the index: boost} """
+        snapshot = client.snapshot
+        if snapshot is None:
+            return None
+        positions = self.positions(name, snapshot.index)
+        return {positions[key]: boost(score) for key, score in self.frecency.scores().items() if key in positions}
+
+    def frecent(self, accounts=None):
+        """ The most used entries of all unlocked accounts, like search() """
+        scores = self.frecency.scores()
+        ranked = []
+        for name, client in self.unlocked() if accounts is None else accounts:
+            snapshot = client.snapshot
+            if snapshot is None:
+                continue
+            positions = self.positions(name, snapshot.index)
+            ranked.extend((score, AccountResult(name, snapshot.index.items[positions[key]]))
+                          for key, score in scores.items() if key in positions)
+        ranked.sort(key=lambda r: -r[0])
+        return RankedResults([r[1] for r in ranked])
+
+    def warm_frecent(self, name, count=FRECENT_WARM_COUNT):
+        """ Fetch details of the most used entries of an account in the background, once it is unlocked """
+        name = name or PRIMARY_ACCOUNT
+        client = self.get(name)
+        if client is None:
+            return
+
+        def run():
+            client.wait_for_post_unlock()
+            if client.has_session():
+                results = self.frecent([(name, client)]).top(count)
+                client.prefetch_entry_details([r.entry.id for r in results])
+
+        threading.Thread(target=run, name="bitwarden-warm-frecent", daemon=True).start()
+
+    def fan_out(self, search_fn):
+        accounts = self.unlocked()
+        executor = self.executor
+        if len(accounts) == 1 or executor is None:
+            results = [(name, search_fn(name, client)) for name, client in accounts]
+        else:
+            caller = threading.get_ident()
+            futures = [(name, executor.submit(self.search_account, caller, search_fn, name, client))
+                       for name, client in accounts]
+            results = []
+            for name, future in futures:
+                try:
+                    results.append((name, future.result()))
+                except BitwardenCliCancelledError:
+                    raise
+                except Exception as e:
+                    # One broken account doesn't hide the results of the others
+                    logger.warning("Search in account %s failed: %s", name, getattr(e, "message", e))
+
+        return AccountMatches(results)
+
+    def search_account(self, caller, search_fn, name, client):
+        helper = threading.get_ident()
+        with self.lock:
+            self.helper_threads.setdefault(caller, set()).add(helper)
+        try:
+            return search_fn(name, client)
+        finally:
+            with self.lock:
+                helpers = self.helper_threads.get(caller)
+                if helpers is not None:
+                    helpers.discard(helper)
+                    if not helpers:
+                        del self.helper_threads[caller]
+
+    def cancel_processes(self, thread_id):
+        """ Kill the CLI processes of a query thread, in every account, including those of its searches """
+        with self.lock:
+            thread_ids = {thread_id} | self.helper_threads.get(thread_id, set())
+        for _, client in self.all():
+            for tid in thread_ids:
+                client.cancel_processes(tid)
+
+    def stop_serve(self):
+        for _, client in self.all():
+            client.stop_serve()
+
+    def close(self):
+        self.stop_serve()
+        self.frecency.close()
@@ -1,9 +1,48 @@
+import logging
+import re
 import subprocess
 import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 from json import JSONDecodeError
 
+from bitwarden_serve import BitwardenServe, BitwardenServeError, route
+from circuit_breaker import CircuitBreaker
+from cli_probe import CliProbeCache, version_at_least
+from entry_prefetch import DetailsCache, DetailsPrefetcher
+from frecency import boosted
+from lock_scheduler import InactivityLockScheduler
+from query_cache import MAX_PREFIX_CANDIDATES, QueryCache
+from query_filters import entry_matches, filter_candidates, parse_query
+from session_state import SessionStateTracker, EXPIRED, LOCKED, LOGGED_OUT, UNLOCKED
+from stats import Stats, command_name
+from totp import TotpError, generate_totp, parse_totp
+from vault_decrypt import LocalSnapshotLoader, LocalVault, VaultDecryptError, cli_data_file
+from vault_index import VaultEntry
+from vault_snapshot import SnapshotLoader, SnapshotLoadError
+from vault_sync import BackgroundSync
+
+logger = logging.getLogger(__name__)
+
+DETAILS_CACHE_TTL = 60
+QUERY_CACHE_SIZE = 64
+# How long a search right after unlock waits for the snapshot instead of asking the CLI
+POST_UNLOCK_WAIT_SECS = 10
+
+# Seconds a CLI process may run before it is killed, by operation class
+CLI_TIMEOUTS = {"search": 30, "get": 15, "sync": 120, "login": 60, "other": 30}
+# Retries after a timeout or a transient failure, only for commands that are safe to repeat
+CLI_RETRIES = {"search": 1, "get": 1, "sync": 1}
+RETRY_DELAY_SECS = 0.25
+# Errors of the CLI that are worth retrying, mostly network errors of Node.js
+TRANSIENT_ERROR_RE = re.compile(
+    rb"ECONNRESET|ETIMEDOUT|ECONNREFUSED|EAI_AGAIN|ENETUNREACH|socket hang up|fetch failed", re.IGNORECASE
+)
+
 
 class BitwardenCliNotFoundError(Exception):
     pass
@@ -22,44 +61,197 @@ class BitwardenVaultLockedError(BitwardenCliError):
         self.message = message
 
 
-class BitwardenClient:
-    """ Wrapper around bitwarden-cli """
+class BitwardenCliCancelledError(BitwardenCliError):
+    """ The bitwarden-cli process was killed because its result is no longer needed """
+
+    def __init__(self, message="Cancelled"):
+        self.message = message
+
+
+class BitwardenCliTimeoutError(BitwardenCliError):
+    """ The bitwarden-cli process didn't finish in time and was killed """
+
+    def __init__(self, message):
+        self.message = message
+
 
-    def __init__(self):
+class BitwardenCliUnavailableError(BitwardenCliError):
+    """ The CLI isn't called because the last calls failed, see CircuitBreaker """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def operation_class(name):
+    """ Operation class of a command name, which determines its timeout and retries """
+    if name.startswith("list"):
+        return "search"
+    if name.startswith("get"):
+        return "get"
+    if name == "sync":
+        return "sync"
+    if name in ("login", "unlock"):
+        return "login"
+    return "other"
+
+
+def is_transient_failure(out, err):
+    if TRANSIENT_ERROR_RE.search(err):
+        return True
+    # Only error responses are searched, item data could contain anything
+    return len(out) < 4096 and b'"success":false' in out.replace(b" ", b"") and bool(TRANSIENT_ERROR_RE.search(out))
+
+
+class ScoredMatches:
+    """
+    All matches of a search in one vault, ranked only as far as asked for.
+    Matches in the index are kept as its {idx: score} map, so that later
+    pages can be ranked without searching again, even after a sync replaced
+    the snapshot. Results of the CLI are kept in their order.
+    """
+
+    def __init__(self, index=None, totals=None, entries=()):
+        self.index = index
+        self.totals = totals
+        self.entries = entries
+        self.total = len(totals) if index is not None else len(entries)
+
+    def top(self, limit):
+        """ The `limit` best matches as (score, entry) pairs, best first """
+        if self.index is not None:
+            return self.index.top(self.totals, limit)
+        return [(-rank, e) for rank, e in enumerate(self.entries[:limit])]
+
+
+def join_present(separator, values):
+    return separator.join(v for v in values if v)
+
+
+def item_details(item):
+    """ Attributes shown when an item is opened, depending on its type """
+    attrs = {"type": item.get("type"), "notes": item.get("notes")}
+    if item.get("fields"):
+        attrs["fields"] = item["fields"]
+
+    login = item.get("login")
+    if login:
+        attrs["username"] = login.get("username")
+        attrs["password"] = login.get("password")
+        attrs["uris"] = [uri["uri"] for uri in login.get("uris") or [] if uri.get("uri")]
+        attrs["totp_secret"] = login.get("totp")
+
+    card = item.get("card")
+    if card:
+        attrs["cardholder"] = card.get("cardholderName")
+        attrs["brand"] = card.get("brand")
+        attrs["number"] = card.get("number")
+        attrs["code"] = card.get("code")
+        attrs["expiration"] = join_present("/", [card.get("expMonth"), card.get("expYear")])
+
+    identity = item.get("identity")
+    if identity:
+        attrs["name"] = join_present(" ", [identity.get(k) for k in ("title", "firstName", "middleName", "lastName")])
+        attrs["username"] = identity.get("username")
+        attrs["email"] = identity.get("email")
+        attrs["phone"] = identity.get("phone")
+        attrs["company"] = identity.get("company")
+        attrs["address"] = join_present(", ", [
+            identity.get("address1"), identity.get("address2"), identity.get("address3"),
+            join_present(" ", [identity.get("postalCode"), identity.get("city")]),
+            identity.get("state"), identity.get("country"),
+        ])
+        attrs["ssn"] = identity.get("ssn")
+        attrs["passport"] = identity.get("passportNumber")
+        attrs["license"] = identity.get("licenseNumber")
+
+    ssh_key = item.get("sshKey")
+    if ssh_key:
+        attrs["private_key"] = ssh_key.get("privateKey")
+        attrs["public_key"] = ssh_key.get("publicKey")
+        attrs["fingerprint"] = ssh_key.get("keyFingerprint")
+    return attrs
+
+
+def kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class BitwardenClient:
+    """
+    Wrapper around bitwarden-cli
+
+    The client is used from the query worker, the sync thread and the main
+    thread, so changes of session, vault snapshot and expiry time are made
+    while holding state_lock.
+
+    Every account has its own client. The CLI keeps the state of an account
+    in its data directory, which is the default one of the CLI unless
+    appdata_dir is given.
+    """
+
+    def __init__(self, appdata_dir=None, probe_cache=None, stats=None, lock_listeners=None):
+        self.state_lock = threading.RLock()
+        self.processes = dict()
+        self.cli_timeouts = dict(CLI_TIMEOUTS)
+        self.breaker = CircuitBreaker()
+        self.appdata_dir = appdata_dir
+        self.stats = stats or Stats()
+        self.query_cache = QueryCache(QUERY_CACHE_SIZE, self.stats)
         self.cli = "bw"
         self.init_done = False
         self.path = None
+        self.path_mtime = None
         self.path_checked = False
+        self.version = None
+        self.probe_cache = probe_cache or CliProbeCache()
+        self.probe_lock = threading.Lock()
         self.server = None
         self.email = None
         self.session = None
-        self.folders = None
+        self.session_state = SessionStateTracker()
+        self.snapshot = None
+        self.post_unlock_done = None
         self.mfa_enabled = None
         self.passphrase_expires_at = None
+        self.pending_cli_lock = False
+        self.lock_scheduler = InactivityLockScheduler(self.run_inactivity_lock)
         self.inactivity_lock_timeout = 0
         self.session_store_cmd = ""
-
-    def initialize(self, server, email, mfa_enabled, inactivity_lock_timeout, session_store_cmd):
+        self.serve_enabled = False
+        self.serve = None
+        self.native_enabled = False
+        self.local_vault = None
+        self.background_sync = BackgroundSync(self.sync)
+        self.snapshot_loader = SnapshotLoader(self.run_cli_session)
+        self.details_cache = DetailsCache(DETAILS_CACHE_TTL)
+        self.prefetcher = DetailsPrefetcher(self.fetch_entry_details, self.details_cache)
+        # Called without arguments whenever the secrets are dropped from memory
+        self.lock_listeners = lock_listeners if lock_listeners is not None else []
+
+    def initialize(self, server, email, mfa_enabled, inactivity_lock_timeout, session_store_cmd,
+                   serve_enabled=False, native_enabled=False):
         """
         Check that
         - we can call the CLI
-        Don't call more than once.
+        The probes only run once, and usually already ran in warm_up().
         """
         self.server = server
         self.email = email
         self.mfa_enabled = mfa_enabled
         self.inactivity_lock_timeout = inactivity_lock_timeout
         self.session_store_cmd = session_store_cmd
+        self.serve_enabled = serve_enabled
+        self.native_enabled = native_enabled
         if not self.init_done:
-            self.configure_server()
-            if self.can_execute_cli():
-                self.init_done = True
-            else:
-                raise BitwardenCliNotFoundError()
+            self.probe_cli()
+            self.init_done = True
 
-        if self.inactivity_lock_timeout and self.passphrase_expires_at is not None:
-            if datetime.now() > self.passphrase_expires_at:
-                self.lock()
+        # Normally the lock scheduler already did this when the timeout passed
+        if self.expire_session():
+            self.lock_scheduler.wake()
 
     def change_server_url(self, new_server_url):
         """
@@ -83,7 +275,9 @@ class BitwardenClient:
         Change the inactivity lock timeout and immediately lock the database.
         """
         self.inactivity_lock_timeout = secs
-        self.passphrase_expires_at = None
+        with self.state_lock:
+            self.passphrase_expires_at = None
+        self.lock_scheduler.cancel()
 
     def change_session_store_cmd(self, cmd):
         """
@@ -91,15 +285,89 @@ class BitwardenClient:
         """
         self.session_store_cmd = cmd
 
+    def change_serve_enabled(self, enabled):
+        """
+        Enable or disable the `bw serve` backend. When enabled on an unlocked
+        vault, the server is started right away.
+        """
+        self.serve_enabled = enabled
+        if enabled and self.has_session():
+            self.start_serve()
+        else:
+            self.stop_serve()
+
+    def change_native_enabled(self, enabled):
+        """
+        Enable or disable reading the vault from the local data.json of the
+        CLI. The snapshot is reloaded from the chosen source.
+        """
+        self.native_enabled = enabled
+        if self.has_session():
+            self.load_snapshot()
+
+    def start_serve(self):
+        if self.serve is None:
+            self.serve = BitwardenServe(self.cli)
+        try:
+            self.serve.start(self.session, env=self.cli_env())
+        except BitwardenServeError:
+            self.serve = None
+
+    def stop_serve(self):
+        if self.serve is not None:
+            self.serve.stop()
+            self.serve = None
+
     def configure_server(self):
         self.run_cli_session("config", "server", self.server)
+        if self.path_checked:
+            self.probe_cache.update(self.path, self.path_mtime, server=self.server)
+
+    def probe_cli(self, server=None):
+        """
+        Find the CLI, read its version and configure the server. Results are
+        taken from the probe cache as long as the binary hasn't changed.
+        """
+        with self.probe_lock:
+            if server is not None:
+                self.server = server
+            (path, mtime) = self.probe_cache.resolve(self.cli)
+            if path is None:
+                raise BitwardenCliNotFoundError()
+            cached = self.probe_cache.get(path, mtime)
+            (self.path, self.path_mtime) = (path, mtime)
+            self.version = cached.get("version")
+            if self.version is None:
+                self.version = self.read_bw_version()
+                self.probe_cache.update(path, mtime, version=self.version)
+            self.path_checked = True
+            if self.server and cached.get("server") != self.server:
+                self.configure_server()
+
+    def warm_up(self, server):
+        """ Run the CLI probes in the background, before the first query arrives """
+        threading.Thread(target=self.run_warm_up, args=(server,), name="bitwarden-warm-up", daemon=True).start()
+
+    def run_warm_up(self, server):
+        try:
+            self.probe_cli(server)
+        except (BitwardenCliError, BitwardenCliNotFoundError):
+            # Reported by initialize() on the next query
+            pass
 
     def need_login(self):
+        if self.session_state.is_known():
+            return not self.session_state.is_logged_in()
         try:
             (err, out) = self.run_cli_session("login", "--check")
-            return self.handle_unlock_result(err, out)
+            result = self.handle_unlock_result(err, out)
         except BitwardenVaultLockedError:
             return True
+        if result:
+            self.session_state.set(LOGGED_OUT)
+        else:
+            self.session_state.set(UNLOCKED if self.has_session() else LOCKED)
+        return result
 
     def need_mfa(self):
         return self.mfa_enabled
@@ -107,8 +375,12 @@ class BitwardenClient:
     def need_unlock(self):
         if not self.has_session():
             return True
+        if self.session_state.is_known():
+            return not self.session_state.is_unlocked()
         (err, out) = self.run_cli_session("unlock", "--check")
-        return self.handle_unlock_result(err, out)
+        result = self.handle_unlock_result(err, out)
+        self.session_state.set(LOCKED if result else UNLOCKED)
+        return result
 
     def has_session(self):
         return self.session is not None
@@ -131,185 +403,555 @@ class BitwardenClient:
         elif self.need_unlock():
             success = self.unlock(pp)
         if success:
-            self.run_cli_store_session()
-            self.list_folders()
+            self.start_post_unlock()
         return success
 
+    def start_post_unlock(self):
+        """
+        Store the session, start `bw serve` and load the snapshot in
+        parallel on a background thread, so that the unlock window can close
+        right away. Searches wait for it, see wait_for_post_unlock().
+        """
+        done = threading.Event()
+        with self.state_lock:
+            self.post_unlock_done = done
+        tasks = [self.run_cli_store_session, self.load_snapshot]
+        if self.serve_enabled:
+            tasks.append(self.start_serve)
+
+        def run():
+            try:
+                with self.stats.timer("post_unlock"), ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+                    for future in [executor.submit(task) for task in tasks]:
+                        try:
+                            future.result()
+                        except Exception:
+                            logger.exception("Post-unlock task failed")
+            finally:
+                done.set()
+
+        threading.Thread(target=run, name="bitwarden-post-unlock", daemon=True).start()
+
+    def wait_for_post_unlock(self):
+        done = self.post_unlock_done
+        if done is not None and not done.is_set():
+            done.wait(POST_UNLOCK_WAIT_SECS)
+
     def login(self, pp, mfa):
         args = ["login", self.email, "--raw"]
         if self.mfa_enabled and mfa:
             args.append("--code")
             args.append(mfa)
         (err, out) = self.run_cli_pp(pp, *args)
-        if out:
-            self.session = out
-            return True
-        else:
-            self.session = None
-            return False
+        with self.state_lock:
+            self.session = out or None
+            self.pending_cli_lock = False
+        self.session_state.set(UNLOCKED if out else LOGGED_OUT)
+        self.extend_passphrase_expiry()
+        return bool(out)
 
     def logout(self):
-        self.session = None
+        self.clear_secrets()
+        self.stop_serve()
+        self.session_state.set(LOGGED_OUT)
         (err, out) = self.run_cli_session("logout")
         if err:
             raise BitwardenCliError(err)
 
     def unlock(self, pp):
         (err, out) = self.run_cli_pp(pp, "unlock", "--raw")
-        if out:
-            self.session = out
-            return True
-        else:
-            self.session = None
-            return False
+        with self.state_lock:
+            self.session = out or None
+            self.pending_cli_lock = False
+        self.session_state.set(UNLOCKED if out else LOCKED)
+        self.extend_passphrase_expiry()
+        return bool(out)
 
     def lock(self):
-        self.session = None
+        self.clear_secrets()
+        if self.session_state.get() != LOGGED_OUT:
+            self.session_state.set(LOCKED)
         (err, out) = self.run_cli_session("lock")
+        self.stop_serve()
         if err:
             raise BitwardenCliError(err)
         else:
             return True
 
+    def clear_secrets(self):
+        """ Drop the session and everything read with it: snapshot, folders, details and cached results """
+        with self.state_lock:
+            self.session = None
+            self.snapshot = None
+            self.local_vault = None
+            self.passphrase_expires_at = None
+            self.forget_entry_details()
+        self.lock_scheduler.cancel()
+        self.notify_locked()
+
+    def expire_session(self):
+        """
+        Clear the secrets from memory once the inactivity timeout passed.
+        Locking the CLI is left to run_inactivity_lock(). Returns True if the
+        session expired now.
+        """
+        with self.state_lock:
+            expired = (
+                self.inactivity_lock_timeout
+                and self.passphrase_expires_at is not None
+                and datetime.now() >= self.passphrase_expires_at
+            )
+            if not expired:
+                return False
+            self.session = None
+            self.snapshot = None
+            self.local_vault = None
+            self.passphrase_expires_at = None
+            self.pending_cli_lock = True
+            self.forget_entry_details()
+        if self.session_state.is_logged_in():
+            self.session_state.set(EXPIRED)
+        self.notify_locked()
+        return True
+
+    def add_lock_listener(self, listener):
+        """ Have listener() drop what was read from the vault, whenever the secrets are dropped """
+        self.lock_listeners.append(listener)
+
+    def notify_locked(self):
+        for listener in list(self.lock_listeners):
+            listener()
+
+    def run_inactivity_lock(self):
+        """ Called on the lock scheduler thread, so that no query waits for `bw lock` """
+        self.expire_session()
+        with self.state_lock:
+            pending = self.pending_cli_lock
+            self.pending_cli_lock = False
+        if pending:
+            self.stop_serve()
+            try:
+                self.run_cli_session("lock")
+            except (BitwardenCliError, BitwardenCliNotFoundError):
+                pass
+
     def sync(self):
+        """
+        Synchronize the vault and apply added, changed and deleted items to
+        a new snapshot. Searches keep using the previous snapshot until the
+        new one is swapped in.
+        """
+        session = self.session
         (err, out) = self.run_cli_session("sync")
         if err:
             raise BitwardenCliError(err)
         else:
-            self.list_folders()
-            return True
+            return self.load_snapshot(session)
 
-    def list_folders(self):
-        (err, out) = self.run_cli_session("list", "folders")
-        if err:
-            self.folders = None
-            return False
-        else:
-            self.folders = dict()
-            for item in out["data"]["data"]:
-                self.folders[item["id"]] = item["name"]
-            return True
+    def sync_in_background(self, callback=None):
+        """
+        Start sync on a background thread, or join the one already running.
+        The callback receives (success, error) when it finishes.
+        """
+        return self.background_sync.request(callback)
+
+    def load_snapshot(self, session=None):
+        """
+        Fetch items, folders, collections and organizations concurrently and
+        publish them as one snapshot, so that searches don't need to call the CLI.
+        """
+        if session is None:
+            session = self.session
+        (local_vault, snapshot) = self.load_local_snapshot(session)
+        if snapshot is None:
+            try:
+                snapshot = self.snapshot_loader.load(self.snapshot)
+            except SnapshotLoadError:
+                return False
+        with self.state_lock:
+            if session is None or self.session != session:
+                # The vault was locked while loading
+                return False
+            self.snapshot = snapshot
+            self.local_vault = local_vault
+            self.query_cache.clear()
+        return True
+
+    def load_local_snapshot(self, session):
+        """
+        Read the snapshot straight from the data.json of the CLI, when
+        enabled. Returns (None, None) when the CLI has to be used instead.
+        """
+        if not self.native_enabled or session is None:
+            return None, None
+        try:
+            local_vault = LocalVault(cli_data_file(self.appdata_dir), session)
+            with self.stats.timer("native.load"):
+                return local_vault, LocalSnapshotLoader(local_vault).load(self.snapshot)
+        except VaultDecryptError as e:
+            logger.warning("Cannot read the local vault, falling back to the CLI: %s", e.message)
+            self.stats.increment("native.fallbacks")
+            return None, None
 
     def get_folder(self, folder_id):
-        if folder_id in self.folders:
-            return self.folders[folder_id]
+        snapshot = self.snapshot
+        if snapshot is not None and folder_id in snapshot.folders:
+            return snapshot.folders[folder_id]
         else:
             return ""
 
-    def search(self, query):
+    def search(self, query, limit=None):
         if len(query) < 2:
             return []
 
+        if self.snapshot is None:
+            self.wait_for_post_unlock()
+        snapshot = self.snapshot
+        if snapshot is not None:
+            self.extend_passphrase_expiry()
+            return self.query_cache.search(snapshot.index, query, limit)
+
         (err, out) = self.run_cli_session("list", "items", "--search", query)
         if err:
             raise BitwardenCliError(err)
         else:
-            return out["data"]["data"]
+            return [VaultEntry.from_item(item) for item in out["data"]["data"]]
 
-    def get_entry_details(self, entry):
-        attrs = dict()
+    def match_scored(self, query, boosts=None):
+        """
+        All items matching the query as ScoredMatches. Results of the CLI
+        aren't scored, their order is kept with decreasing scores below those
+        of the index.
+
+        The query may contain filters, see query_filters. Boosts are added
+        to the scores of items of the index, as {position: boost}.
+        """
+        if len(query) < 2:
+            return ScoredMatches()
+
+        (filters, text) = parse_query(query)
+        if self.snapshot is None:
+            self.wait_for_post_unlock()
+        snapshot = self.snapshot
+        if snapshot is not None:
+            self.extend_passphrase_expiry()
+            if filters:
+                totals = self.match_filtered(snapshot, filters, text)
+            else:
+                totals = self.query_cache.match(snapshot.index, query).totals
+            return ScoredMatches(snapshot.index, boosted(totals, boosts))
+
+        return ScoredMatches(entries=[e for e in self.search(text) if entry_matches(e, filters)])
+
+    def match_filtered(self, snapshot, filters, text):
+        """
+        {idx: score} of the items passing the filters and matching the text.
+        Without text, all items passing the filters match.
+        """
+        index = snapshot.index
+        candidates = filter_candidates(index, snapshot, filters)
+        if not text:
+            return dict.fromkeys(candidates, 0)
+        if len(candidates) <= MAX_PREFIX_CANDIDATES:
+            totals = index.match(text, candidates)[0]
+            if totals:
+                return totals
+        totals = self.query_cache.match(index, text).totals
+        if len(candidates) < len(totals):
+            return {idx: totals[idx] for idx in candidates if idx in totals}
+        return {idx: score for idx, score in totals.items() if idx in candidates}
+
+    def match_site(self, site, boosts=None):
+        """
+        Logins with a URI matching the site (a domain, host or URL), as
+        match_scored() returns them. Uses the URI index of the snapshot,
+        which respects the match type of every URI like `bw list items --url`.
+        """
+        if not site:
+            return ScoredMatches()
 
-        (err, out) = self.run_cli_session("get", "item", entry)
+        if self.snapshot is None:
+            self.wait_for_post_unlock()
+        snapshot = self.snapshot
+        if snapshot is not None:
+            self.extend_passphrase_expiry()
+            return ScoredMatches(snapshot.index, boosted(snapshot.index.match_site(site), boosts))
+
+        (err, out) = self.run_cli_session("list", "items", "--url", site)
         if err:
             raise BitwardenCliError(err)
-        else:
-            data = out["data"]
-            login = data["login"]
-            if "fields" in data:
-                attrs["fields"] = data["fields"]
-
-            attrs["username"] = login["username"]
-            attrs["password"] = login["password"]
-            if "uris" in login:
-                uris = login["uris"]
-                attrs["uri"] = uris[0]["uri"] if uris else ""
+        return ScoredMatches(entries=[VaultEntry.from_item(item) for item in out["data"]["data"]])
 
-            if "totp" in login and login["totp"]:
+    def get_entry_details(self, entry):
+        """
+        Item attributes come from the details cache when the entry has been
+        prefetched. TOTP codes are generated from the cached secret every
+        time, together with the number of seconds they remain valid.
+        """
+        attrs = self.details_cache.get(entry)
+        if attrs is None:
+            attrs = self.fetch_entry_details(entry)
+        else:
+            self.extend_passphrase_expiry()
+        if attrs.get("totp_secret"):
+            attrs = dict(attrs)
+            try:
+                (attrs["totp"], attrs["totp_remaining"]) = generate_totp(parse_totp(attrs["totp_secret"]))
+            except TotpError:
+                # Leave formats we don't understand to the CLI
                 (err, out) = self.run_cli_session("get", "totp", entry)
                 attrs["totp"] = out["data"]["data"]
         return attrs
 
-    def can_execute_cli(self):
+    def get_totp(self, entry):
+        """ Returns a fresh TOTP code of the entry """
+        return self.get_entry_details(entry).get("totp")
+
+    def prefetch_entry_details(self, entries):
+        """ Fetch details of the given entries in the background, to make opening them instant """
+        if self.has_session():
+            self.prefetcher.prefetch(entries)
+
+    def forget_entry_details(self):
+        self.prefetcher.cancel()
+        self.details_cache.clear()
+        self.query_cache.clear()
+
+    def fetch_entry_details(self, entry):
+        session = self.session
+        attrs = dict()
+
+        data = self.read_local_item(entry)
+        if data is None:
+            (err, out) = self.run_cli_session("get", "item", entry)
+            if err:
+                raise BitwardenCliError(err)
+            data = out["data"]
+        attrs = item_details(data)
+        with self.state_lock:
+            if session is not None and self.session == session:
+                self.details_cache.put(entry, attrs)
+        return attrs
+
+    def read_local_item(self, entry):
+        """ Decrypt the item from the local vault, returns None when the CLI has to be asked """
+        local_vault = self.local_vault
+        if local_vault is None:
+            return None
         try:
-            subprocess.run([self.cli], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except FileNotFoundError:
-            return False
+            with self.stats.timer("native.get_item"):
+                return local_vault.get_item(entry)
+        except VaultDecryptError as e:
+            logger.warning("Cannot decrypt item locally, falling back to the CLI: %s", e.message)
+            self.stats.increment("native.fallbacks")
+            return None
 
     def get_bw_version(self):
-        try:
-            cp = subprocess.run(
-                [self.cli, "--version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-        except FileNotFoundError:
-            raise BitwardenCliNotFoundError()
+        if self.version is None:
+            self.version = self.read_bw_version()
+        return self.version
+
+    def is_cli_version_supported(self, min_version):
+        return version_at_least(self.get_bw_version(), min_version)
 
-        out = cp.stdout.decode("utf-8")
-        return str(out).strip()
+    def read_bw_version(self):
+        out = self.run_process([self.cli, "--version"], timeout=self.cli_timeouts["other"])[0]
+        return out.decode("utf-8").strip()
 
     def run_cli_session(self, *args):
+        name = command_name(args)
+        out_json = self.run_serve_request(name, args)
+        if out_json is None:
+            env_vars = self.cli_env()
+            if self.session:
+                env_vars["BW_SESSION"] = self.session
+            out = self.run_timed_process(name, [self.cli, *args, "--response"], env=env_vars)[0]
+            out = out.decode("utf-8")
+            if out:
+                self.stats.increment("cli.bytes_parsed", len(out))
+                with self.stats.timer("json.parse"):
+                    out_json = json.loads(out)
+
+        self.extend_passphrase_expiry()
+
+        err_json = None
+
+        if out_json:
+            if not out_json["success"]:
+                self.stats.increment("cli.{}.errors".format(name))
+                if out_json["message"] == "You are not logged in.":
+                    self.session_state.set(LOGGED_OUT)
+                    raise BitwardenVaultLockedError(out_json["message"])
+
+        return err_json, out_json
+
+    def cli_env(self):
         env_vars = os.environ.copy()
-        if self.session:
-            env_vars["BW_SESSION"] = self.session
-        try:
-            cp = subprocess.run(
-                [self.cli, *args, "--response"],
-                env=env_vars,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-        except FileNotFoundError:
-            raise BitwardenCliNotFoundError()
+        if self.appdata_dir:
+            env_vars["BITWARDENCLI_APPDATA_DIR"] = self.appdata_dir
+        return env_vars
 
-        if self.inactivity_lock_timeout:
-            self.passphrase_expires_at = datetime.now() + timedelta(
-                seconds=self.inactivity_lock_timeout
+    def run_timed_process(self, name, cmd, env=None, input=None):
+        """
+        run_process() with the timeout of the operation class of the command.
+        Commands that are safe to repeat are retried after a timeout or a
+        transient failure. Timeouts and transient failures trip the circuit
+        breaker, except for login and unlock, which the user asked for.
+        """
+        kind = operation_class(name)
+        guarded = kind != "login"
+        if guarded and not self.breaker.allow():
+            self.stats.increment("cli.{}.rejected".format(name))
+            raise BitwardenCliUnavailableError(
+                "bw is not responding, trying again in {} seconds".format(self.breaker.retry_in())
             )
+        try:
+            for attempt in range(CLI_RETRIES.get(kind, 0) + 1):
+                if attempt:
+                    if guarded and self.breaker.is_open():
+                        break
+                    self.stats.increment("cli.{}.retries".format(name))
+                    time.sleep(RETRY_DELAY_SECS * attempt)
+                try:
+                    (out, err) = self.run_attempt(name, cmd, env, input, self.cli_timeouts[kind])
+                    failure = None
+                except BitwardenCliTimeoutError as e:
+                    failure = e
+                if failure is None and not is_transient_failure(out, err):
+                    if guarded:
+                        self.breaker.record_success()
+                    return out, err
+                if guarded:
+                    self.breaker.record_failure()
+        finally:
+            if guarded:
+                self.breaker.cancel_trial()
+        if failure is not None:
+            raise failure
+        return out, err
+
+    def run_attempt(self, name, cmd, env, input, timeout):
+        """ run_process(), recording call count, duration and failures of the command """
+        self.stats.increment("cli.{}.calls".format(name))
+        start = time.perf_counter()
+        try:
+            return self.run_process(cmd, env=env, input=input, timeout=timeout)
+        except BitwardenCliTimeoutError:
+            self.stats.increment("cli.{}.timeouts".format(name))
+            self.stats.increment("cli.{}.errors".format(name))
+            raise
+        except (BitwardenCliError, BitwardenCliNotFoundError):
+            self.stats.increment("cli.{}.errors".format(name))
+            raise
+        finally:
+            self.stats.record_time("cli." + name, time.perf_counter() - start)
+
+    def run_serve_request(self, name, args):
+        """
+        Send the command to the `bw serve` backend when it is running and
+        supports it. Returns None when the caller has to fall back to the CLI.
+        """
+        serve = self.serve
+        if serve is None or not serve.is_ready():
+            return None
+        request = route(args)
+        if request is None:
+            return None
+        self.stats.increment("serve.{}.calls".format(name))
+        try:
+            with self.stats.timer("serve." + name):
+                return serve.request(*request)
+        except BitwardenServeError:
+            self.stats.increment("serve.{}.errors".format(name))
+            self.stop_serve()
+            return None
 
-        err = cp.stderr.decode("utf-8")
-        out = cp.stdout.decode("utf-8")
+    def run_cli_pp(self, passphrase, *args):
+        name = command_name(args)
+        (out, err) = self.run_timed_process(
+            name, [self.cli, *args], env=self.cli_env(), input=bytes(passphrase, "utf-8")
+        )
+        if not out:
+            self.stats.increment("cli.{}.errors".format(name))
 
-        err_json = None
-        out_json = None
+        self.extend_passphrase_expiry()
 
-        if out:
-            out_json = json.loads(out)
-            if not out_json["success"] and out_json["message"] == "You are not logged in.":
-                raise BitwardenVaultLockedError(out_json["message"])
+        return err.decode("utf-8"), out.decode("utf-8")
 
-        return err_json, out_json
+    def extend_passphrase_expiry(self):
+        """ Move the inactivity lock deadline, only while there is a session to lock """
+        if self.inactivity_lock_timeout:
+            with self.state_lock:
+                if self.session is None:
+                    return
+                self.passphrase_expires_at = datetime.now() + timedelta(
+                    seconds=self.inactivity_lock_timeout
+                )
+                deadline = self.passphrase_expires_at
+            self.lock_scheduler.schedule(deadline)
+
+    def run_process(self, cmd, env=None, input=None, timeout=None):
+        """
+        Run a CLI process, and keep track of it, so that it can be killed by
+        cancel_processes() from another thread. Returns (stdout, stderr).
 
-    def run_cli_pp(self, passphrase, *args):
+        The process runs in its own process group. When it takes longer than
+        the timeout the whole group is killed, including any helpers it
+        started, and BitwardenCliTimeoutError is raised.
+        """
         try:
-            cp = subprocess.run(
-                [self.cli, *args],
+            process = subprocess.Popen(
+                cmd,
+                env=env,
+                stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                input=bytes(passphrase, "utf-8"),
+                start_new_session=True,
             )
         except FileNotFoundError:
             raise BitwardenCliNotFoundError()
 
-        if self.inactivity_lock_timeout:
-            self.passphrase_expires_at = datetime.now() + timedelta(
-                seconds=self.inactivity_lock_timeout
-            )
-
-        return cp.stderr.decode("utf-8"), cp.stdout.decode("utf-8")
+        thread_id = threading.get_ident()
+        with self.state_lock:
+            self.processes.setdefault(thread_id, set()).add(process)
+        timed_out = False
+        try:
+            (out, err) = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            kill_process_group(process)
+            process.communicate()
+        finally:
+            with self.state_lock:
+                processes = self.processes[thread_id]
+                processes.discard(process)
+                if not processes:
+                    del self.processes[thread_id]
+
+        if getattr(process, "cancelled", False):
+            raise BitwardenCliCancelledError()
+        if timed_out:
+            raise BitwardenCliTimeoutError("{} did not finish within {} seconds".format(cmd[0], timeout))
+        return out, err
+
+    def cancel_processes(self, thread_id):
+        """ Kill all CLI processes (with their children) started by the given thread """
+        with self.state_lock:
+            processes = list(self.processes.get(thread_id, ()))
+        for process in processes:
+            process.cancelled = True
+            kill_process_group(process)
 
     def run_cli_store_session(self):
         if self.session_store_cmd == '':
             return
         try:
-            cp = subprocess.run(
+            self.run_process(
                 [self.session_store_cmd],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
                 input=bytes(self.session, "utf-8"),
+                timeout=self.cli_timeouts["other"],
             )
-        except FileNotFoundError:
-            raise BitwardenCliNotFoundError()
+        except (BitwardenCliNotFoundError, BitwardenCliError):
+            raise
         except Exception as e:
             raise BitwardenCliError(e)
@@ -0,0 +1,165 @@
+import ctypes
+import http.client
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+PR_SET_PDEATHSIG = 1
+
+# Resolved here, the child may only make the prctl call between fork and exec
+libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+
+# The parent death signal is sent when the thread that started the child
+# exits, not the process. Servers are started from this thread, which lives
+# as long as the extension, so that they never outlive it.
+launcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bitwarden-serve-launcher")
+
+
+class BitwardenServeError(Exception):
+    """ Raised when the `bw serve` backend cannot answer a request """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def find_free_port(hostname):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((hostname, 0))
+        return s.getsockname()[1]
+
+
+def die_with_parent():
+    """ Runs in the child before exec: have the kernel kill it when the extension dies, even by SIGKILL """
+    if libc is not None:
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+
+def route(args):
+    """
+    Translate bitwarden-cli arguments into a (method, path) pair of the
+    `bw serve` REST API. Returns None for commands the API does not cover.
+    """
+    args = tuple(args)
+    if args == ("list", "items"):
+        return "GET", "/list/object/items"
+    if len(args) == 4 and args[:3] == ("list", "items", "--search"):
+        return "GET", "/list/object/items?" + urlencode({"search": args[3]})
+    if len(args) == 4 and args[:3] == ("list", "items", "--url"):
+        return "GET", "/list/object/items?" + urlencode({"url": args[3]})
+    if len(args) == 2 and args[0] == "list" and args[1] in ("folders", "collections", "organizations"):
+        return "GET", "/list/object/" + args[1]
+    if len(args) == 3 and args[:2] == ("get", "item"):
+        return "GET", "/object/item/" + quote(args[2], safe="")
+    if len(args) == 3 and args[:2] == ("get", "totp"):
+        return "GET", "/object/totp/" + quote(args[2], safe="")
+    if args == ("sync",):
+        return "POST", "/sync"
+    if args == ("lock",):
+        return "POST", "/lock"
+    return None
+
+
+class BitwardenServe:
+    """
+    Keeps a single `bw serve` process running on localhost and talks to it
+    over a small pool of keep-alive HTTP connections, so that every query does
+    not have to boot a new Node.js runtime.
+    """
+
+    def __init__(self, cli, hostname="127.0.0.1", pool_size=4, timeout=30):
+        self.cli = cli
+        self.hostname = hostname
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.port = None
+        self.process = None
+        self.ready = False
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def start(self, session, env=None):
+        self.stop()
+        env_vars = (env or os.environ).copy()
+        env_vars["BW_SESSION"] = session
+        self.port = find_free_port(self.hostname)
+        try:
+            self.process = launcher.submit(
+                subprocess.Popen,
+                [self.cli, "serve", "--hostname", self.hostname, "--port", str(self.port)],
+                env=env_vars,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=die_with_parent,
+            ).result()
+        except FileNotFoundError:
+            self.process = None
+            raise BitwardenServeError("Cannot execute {}".format(self.cli))
+
+    def stop(self):
+        self.ready = False
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_ready(self):
+        """
+        The server needs a moment to boot. Until it accepts connections
+        callers should keep using the CLI, so this check never blocks.
+        """
+        if not self.is_running():
+            self.ready = False
+            return False
+        if not self.ready:
+            try:
+                socket.create_connection((self.hostname, self.port), timeout=0.05).close()
+                self.ready = True
+            except OSError:
+                return False
+        return True
+
+    def request(self, method, path):
+        connection = self.acquire_connection()
+        try:
+            connection.request(method, path, headers={"Connection": "keep-alive"})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise BitwardenServeError(str(e))
+
+        self.release_connection(connection)
+        try:
+            return json.loads(body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise BitwardenServeError(str(e))
+
+    def acquire_connection(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.hostname, self.port, timeout=self.timeout)
+
+    def release_connection(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
@@ -0,0 +1,65 @@
+import threading
+import time
+
+FAILURE_THRESHOLD = 3
+RESET_SECS = 30
+
+
+class CircuitBreaker:
+    """
+    Stops calling the CLI for a while after several calls in a row failed
+    with a timeout or a transient error, so that every query doesn't wait
+    for a timeout again while bw or the network is broken.
+
+    After reset_secs a single trial call is let through. Its success closes
+    the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_secs=RESET_SECS):
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        """ Whether a call may be made now """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_secs:
+                return False
+            self.trial_running = True
+            return True
+
+    def retry_in(self):
+        """ Seconds until the next trial call is let through """
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(0, int(self.reset_secs - (time.monotonic() - self.opened_at)))
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def cancel_trial(self):
+        """ The trial call ended without telling anything about the health of the CLI """
+        with self.lock:
+            self.trial_running = False
+
+    def reset(self):
+        self.record_success()
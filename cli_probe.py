@@ -0,0 +1,84 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ulauncher-bitwarden"
+)
+CACHE_FILE = os.path.join(CACHE_DIR, "cli.json")
+
+
+def parse_version(version):
+    """ "2024.3.1" -> (2024, 3, 1), anything after the numeric part is ignored """
+    match = re.match(r"\s*v?(\d+(?:\.\d+)*)", version or "")
+    if not match:
+        return ()
+    return tuple(int(part) for part in match.group(1).split("."))
+
+
+def version_at_least(version, min_version):
+    return parse_version(version) >= parse_version(min_version)
+
+
+class CliProbeCache:
+    """
+    Results of probing the bw binary (version, configured server), kept on
+    disk across restarts. Entries are keyed by the resolved path of the
+    binary and are only valid while its mtime doesn't change.
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = dict()
+        return self.entries
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The cache only saves time, failing to write it is not an error
+            pass
+
+    @staticmethod
+    def resolve(cli):
+        """ Returns (path, mtime) of the binary, or (None, None) if it can't be found """
+        path = shutil.which(cli)
+        if path is None:
+            return None, None
+        path = os.path.realpath(path)
+        try:
+            return path, os.stat(path).st_mtime
+        except OSError:
+            return None, None
+
+    def get(self, path, mtime):
+        with self.lock:
+            entry = self.load().get(path)
+            if entry is None or entry.get("mtime") != mtime:
+                return dict()
+            return dict(entry)
+
+    def update(self, path, mtime, **values):
+        with self.lock:
+            entries = self.load()
+            entry = entries.get(path)
+            if entry is None or entry.get("mtime") != mtime:
+                entry = {"mtime": mtime}
+            entry.update(values)
+            entries[path] = entry
+            self.save()
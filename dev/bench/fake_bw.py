@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the bw executable, serving a generated vault.
+
+Configured through environment variables:
+- BENCH_BW_VAULT: path of the vault JSON written by run_bench.py
+- BENCH_BW_STARTUP_LATENCY: seconds to sleep on every start, to simulate Node.js startup
+- BENCH_BW_HANG_RATE: fraction of list and get commands that never finish, to simulate a stuck network
+"""
+import json
+import os
+import random
+import sys
+import time
+
+SESSION = "bench-session"
+PASSWORD = "bench"
+
+
+def respond(data=None, success=True, message=None):
+    out = {"success": success}
+    if data is not None:
+        out["data"] = data
+    if message is not None:
+        out["message"] = message
+    print(json.dumps(out))
+
+
+def load_vault():
+    with open(os.environ["BENCH_BW_VAULT"], "r") as f:
+        return json.load(f)
+
+
+def unlocked():
+    return os.environ.get("BW_SESSION") == SESSION
+
+
+def main(args):
+    time.sleep(float(os.environ.get("BENCH_BW_STARTUP_LATENCY", "0")))
+    args = [a for a in args if a != "--response"]
+    if args and args[0] in ("list", "get") and random.random() < float(os.environ.get("BENCH_BW_HANG_RATE", "0")):
+        time.sleep(3600)
+
+    if args == ["--version"]:
+        print("2024.3.1")
+    elif args[:2] == ["config", "server"]:
+        respond({"object": "message", "title": "Saved setting `config`."})
+    elif args == ["login", "--check"]:
+        respond({"object": "message", "title": "You are logged in!"})
+    elif args == ["unlock", "--check"]:
+        if unlocked():
+            respond({"object": "message", "title": "Vault is unlocked!"})
+        else:
+            respond(success=False, message="Vault is locked.")
+    elif args[0] in ("unlock", "login") and "--raw" in args:
+        if sys.stdin.read() == PASSWORD:
+            sys.stdout.write(SESSION)
+        else:
+            sys.stderr.write("Invalid master password.")
+            return 1
+    elif args[0] in ("lock", "logout", "sync"):
+        respond({"object": "message", "title": "Done"})
+    elif not unlocked():
+        respond(success=False, message="Vault is locked.")
+    elif args[0] == "list":
+        vault = load_vault()
+        objects = vault.get(args[1], [])
+        if "--search" in args:
+            query = args[args.index("--search") + 1].lower()
+            objects = [o for o in objects if query in o["name"].lower()]
+        respond({"object": "list", "data": objects})
+    elif args[:2] == ["get", "item"]:
+        items = [i for i in load_vault()["items"] if i["id"] == args[2]]
+        if items:
+            respond(items[0])
+        else:
+            respond(success=False, message="Not found.")
+    elif args[:2] == ["get", "totp"]:
+        respond({"object": "string", "data": "123456"})
+    else:
+        respond(success=False, message="Unsupported command: {}".format(" ".join(args)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark of the extension against a fake bw CLI (fake_bw.py)
+serving generated vaults.
+
+    dev/bench/run_bench.py [--sizes 100,1000,10000,50000] [--startup-latency 0.4]
+                           [--hang-rate 0.05 --cli-timeout 2]
+                           [--output results.json] [--client-only]
+    dev/bench/run_bench.py --compare old.json new.json
+
+Every vault size is measured in a separate process, so that peak RSS is
+reported per size. Driving the event listeners requires ulauncher and
+PyGObject to be installed, use --client-only to only drive BitwardenClient.
+
+With --hang-rate some CLI calls never finish. The tail latency should
+then stay bounded by the CLI timeout, which --cli-timeout shortens.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+
+DEFAULT_SIZES = "100,1000,10000,50000"
+TYPED_QUERIES = 10
+MAX_RESULTS = 6
+PASSWORD = "bench"
+
+WORDS = [
+    "github", "gitlab", "google", "mail", "bank", "amazon", "aws", "azure", "slack", "jira",
+    "confluence", "router", "wifi", "vpn", "server", "database", "postgres", "docker", "npm", "pypi",
+    "twitter", "linkedin", "netflix", "spotify", "steam", "paypal", "insurance", "tax", "school", "work",
+]
+
+
+def random_word(rnd):
+    if rnd.random() < 0.5:
+        return rnd.choice(WORDS)
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 10)))
+
+
+def generate_vault(size, seed=0):
+    rnd = random.Random(seed)
+    folders = [{"object": "folder", "id": "folder-{}".format(i), "name": random_word(rnd).capitalize()}
+               for i in range(max(1, size // 200))]
+    items = []
+    for i in range(size):
+        name = " ".join(random_word(rnd).capitalize() for _ in range(rnd.randint(1, 3)))
+        host = "{}.{}".format(random_word(rnd), rnd.choice(["com", "org", "net", "co.uk", "de"]))
+        login = {
+            "username": "{}@{}".format(random_word(rnd), host),
+            "password": "".join(rnd.choice(string.printable[:94]) for _ in range(20)),
+            "uris": [{"match": None, "uri": "https://{}/login".format(host)}],
+            "totp": "JBSWY3DPEHPK3PXP" if rnd.random() < 0.2 else None,
+        }
+        items.append({
+            "object": "item",
+            "id": "item-{}".format(i),
+            "organizationId": None,
+            "folderId": rnd.choice(folders)["id"] if rnd.random() < 0.7 else None,
+            "type": 1,
+            "name": name,
+            "notes": " ".join(random_word(rnd) for _ in range(rnd.randint(0, 8))) or None,
+            "favorite": False,
+            "login": login,
+            "revisionDate": "2024-01-01T00:00:00.000Z",
+        })
+    return {"items": items, "folders": folders, "collections": [], "organizations": []}
+
+
+def typing_session(vault, count, seed=1):
+    """ Keystroke prefixes of queries a user would type to find some of the items """
+    rnd = random.Random(seed)
+    sessions = []
+    for item in rnd.sample(vault["items"], min(count, len(vault["items"]))):
+        word = item["name"].split()[0].lower()
+        sessions.append([word[:n] for n in range(2, len(word) + 1)])
+    return sessions
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {"p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99), "max_ms": ordered[-1] * 1000,
+            "count": len(ordered)}
+
+
+def make_stub_dir(tmp_dir):
+    """ Directory with a bw executable running fake_bw.py, to be put first on PATH """
+    bin_dir = os.path.join(tmp_dir, "bin")
+    os.makedirs(bin_dir)
+    stub = os.path.join(bin_dir, "bw")
+    with open(stub, "w") as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, os.path.join(BENCH_DIR, "fake_bw.py")))
+    os.chmod(stub, 0o755)
+    return bin_dir
+
+
+def bench_client(vault, cli_timeout=None):
+    from bitwarden import BitwardenClient, BitwardenCliError
+
+    client = BitwardenClient()
+    if cli_timeout:
+        client.cli_timeouts = dict.fromkeys(client.cli_timeouts, cli_timeout)
+    client.initialize("https://vault.example.com", "bench@example.com", False, 0, "")
+    errors = []
+
+    def measure(samples, fn, *args):
+        """ Failed calls are measured too, when the fake bw hangs they end with a timeout """
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        except BitwardenCliError:
+            errors.append(fn.__name__)
+        samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    client.verify_and_set_passphrase(PASSWORD, "")
+    sessions = typing_session(vault, TYPED_QUERIES)
+    measure([], client.search, sessions[0][0], MAX_RESULTS)
+    unlock_to_first_result = time.perf_counter() - start
+
+    keystrokes = []
+    for session in sessions:
+        for query in session:
+            measure(keystrokes, client.search, query, MAX_RESULTS)
+
+    open_entry = []
+    for item in random.Random(2).sample(vault["items"], min(TYPED_QUERIES, len(vault["items"]))):
+        client.forget_entry_details()
+        measure(open_entry, client.get_entry_details, item["id"])
+
+    return {
+        "unlock_to_first_result_ms": unlock_to_first_result * 1000,
+        "keystroke": percentiles(keystrokes),
+        "open_entry": percentiles(open_entry),
+        "cli_errors": len(errors),
+    }
+
+
+def bench_listeners(vault):
+    from gi.repository import Notify
+    from ulauncher.api.shared.event import ItemEnterEvent, KeywordQueryEvent, PreferencesUpdateEvent
+    from ulauncher.search.Query import Query
+
+    import main
+
+    class BenchExtension(main.BitwardenExtension):
+
+        def __init__(self):
+            super(BenchExtension, self).__init__()
+            self.preferences = {
+                "search": "bw", "sync": "bwsync", "lock": "bwlock", "stats": "bwstats",
+                "generate": "bwgen",
+                "server-url": "https://vault.example.com", "email": "bench@example.com", "mfa": "no",
+                "max-results": str(MAX_RESULTS), "inactivity-lock-timeout": "0", "session-store-cmd": "",
+                "serve-backend": "no", "native-backend": "no",
+                "accounts": "",
+            }
+            self.responded = threading.Event()
+
+        def respond(self, event, action):
+            self.responded.set()
+
+    Notify.init("ulauncher-bitwarden-bench")
+    extension = BenchExtension()
+    keyword_listener = main.KeywordQueryEventListener(extension.accounts)
+    item_listener = main.ItemEnterEventListener(extension.accounts)
+    preferences_listener = main.PreferencesUpdateEventListener(extension.accounts)
+
+    def query(text):
+        extension.responded.clear()
+        start = time.perf_counter()
+        keyword_listener.on_event(KeywordQueryEvent(Query(text)), extension)
+        extension.responded.wait()
+        return time.perf_counter() - start
+
+    query("bw ")
+    extension.bitwarden.verify_and_set_passphrase(PASSWORD, "")
+
+    keystrokes = []
+    for session in typing_session(vault, TYPED_QUERIES):
+        for text in session:
+            keystrokes.append(query("bw " + text))
+
+    open_entry = []
+    for item in random.Random(2).sample(vault["items"], min(TYPED_QUERIES, len(vault["items"]))):
+        extension.bitwarden.forget_entry_details()
+        data = {"action": "activate_entry", "id": item["id"], "keyword": "bw"}
+        start = time.perf_counter()
+        item_listener.on_event(ItemEnterEvent(data), extension)
+        open_entry.append(time.perf_counter() - start)
+
+    # A changed preference clears the query cache, so the next query searches again
+    preferences_update = []
+    queries = [text for session in typing_session(vault, TYPED_QUERIES, seed=3) for text in session[-1:]]
+    for (idx, text) in enumerate(queries):
+        old_value = extension.preferences["max-results"]
+        new_value = str(MAX_RESULTS + (idx + 1) % 2)
+        extension.preferences["max-results"] = new_value
+        start = time.perf_counter()
+        preferences_listener.on_event(PreferencesUpdateEvent("max-results", old_value, new_value), extension)
+        query("bw " + text)
+        preferences_update.append(time.perf_counter() - start)
+
+    return {
+        "keystroke": percentiles(keystrokes),
+        "open_entry": percentiles(open_entry),
+        "preferences_update": percentiles(preferences_update),
+    }
+
+
+def run_worker(args):
+    """ Measure a single vault size, called in a separate process by run() """
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(REPO_DIR)
+    with open(os.environ["BENCH_BW_VAULT"], "r") as f:
+        vault = json.load(f)
+
+    result = {"items": len(vault["items"]), "client": bench_client(vault, args.cli_timeout)}
+    if not args.client_only:
+        result["listeners"] = bench_listeners(vault)
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_children_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    json.dump(result, sys.stdout)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode("utf-8").strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    results = dict()
+    with tempfile.TemporaryDirectory(prefix="bw-bench-") as tmp_dir:
+        bin_dir = make_stub_dir(tmp_dir)
+        for size in [int(s) for s in args.sizes.split(",")]:
+            vault_path = os.path.join(tmp_dir, "vault-{}.json".format(size))
+            with open(vault_path, "w") as f:
+                json.dump(generate_vault(size), f)
+
+            env = os.environ.copy()
+            env["PATH"] = bin_dir + os.pathsep + env["PATH"]
+            env["BENCH_BW_VAULT"] = vault_path
+            env["BENCH_BW_STARTUP_LATENCY"] = str(args.startup_latency)
+            env["BENCH_BW_HANG_RATE"] = str(args.hang_rate)
+            # Keep the probe cache of the benchmark away from the real one
+            env["XDG_CACHE_HOME"] = os.path.join(tmp_dir, "cache")
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker"]
+            if args.client_only:
+                cmd.append("--client-only")
+            if args.cli_timeout:
+                cmd.extend(["--cli-timeout", str(args.cli_timeout)])
+            print("Measuring {} items...".format(size), file=sys.stderr)
+            cp = subprocess.run(cmd, env=env, stdout=subprocess.PIPE)
+            if cp.returncode != 0:
+                sys.exit("Benchmark of {} items failed".format(size))
+            results[str(size)] = json.loads(cp.stdout.decode("utf-8"))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "startup_latency": args.startup_latency,
+        "hang_rate": args.hang_rate,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+
+
+def flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            flatten("{}.{}".format(prefix, k) if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def print_report(report):
+    print("commit {}, startup latency {} s".format(report["commit"], report["startup_latency"]))
+    for size, result in report["results"].items():
+        print("{} items".format(size))
+        for metric, value in flatten("", result, dict()).items():
+            print("  {:45} {:12.2f}".format(metric, value))
+
+
+def compare(old_path, new_path):
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+    print("{} -> {}".format(old.get("commit"), new.get("commit")))
+    for size, result in new["results"].items():
+        if size not in old["results"]:
+            continue
+        print("{} items".format(size))
+        old_metrics = flatten("", old["results"][size], dict())
+        for metric, value in flatten("", result, dict()).items():
+            if metric not in old_metrics or metric.endswith(".count"):
+                continue
+            before = old_metrics[metric]
+            change = (value - before) / before * 100 if before else 0.0
+            print("  {:45} {:12.2f} {:12.2f} {:+8.1f}%".format(metric, before, value, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated vault sizes")
+    parser.add_argument("--startup-latency", type=float, default=0.0,
+                        help="seconds the fake bw sleeps on every start")
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="fraction of list and get calls of the fake bw that never finish")
+    parser.add_argument("--cli-timeout", type=float, help="timeout of all CLI calls, in seconds")
+    parser.add_argument("--output", help="write machine readable results to this file")
+    parser.add_argument("--client-only", action="store_true", help="don't drive the event listeners")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.worker:
+        run_worker(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DetailsCache:
+    """ Entry details kept in memory for a short time """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = dict()
+
+    def get(self, entry_id):
+        with self.lock:
+            cached = self.entries.get(entry_id)
+            if cached is None:
+                return None
+            expires_at, details = cached
+            if time.monotonic() > expires_at:
+                del self.entries[entry_id]
+                return None
+            return details
+
+    def put(self, entry_id, details):
+        with self.lock:
+            self.entries[entry_id] = (time.monotonic() + self.ttl, details)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DetailsPrefetcher:
+    """
+    Fetches details of entries the user is likely to open next, using a
+    small thread pool. Entries requested by an older prefetch call, which
+    haven't been started yet, are skipped.
+    """
+
+    def __init__(self, fetch_fn, cache, workers=3):
+        self.fetch_fn = fetch_fn
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bitwarden-prefetch")
+
+    def prefetch(self, entry_ids):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            for entry_id in entry_ids:
+                if entry_id in self.in_flight or self.cache.get(entry_id) is not None:
+                    continue
+                self.in_flight.add(entry_id)
+                self.executor.submit(self.fetch, entry_id, generation)
+
+    def fetch(self, entry_id, generation):
+        try:
+            with self.lock:
+                if generation != self.generation:
+                    return
+            self.fetch_fn(entry_id)
+        except Exception:
+            # Prefetching is best effort, errors are reported when the entry is opened
+            pass
+        finally:
+            with self.lock:
+                self.in_flight.discard(entry_id)
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
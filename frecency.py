@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from cli_probe import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+FRECENCY_FILE = os.path.join(CACHE_DIR, "frecency.json")
+
+# A use counts half as much after two weeks
+HALF_LIFE_SECS = 14 * 24 * 3600
+
+# Uses are written together, at most this long after the first unsaved one
+FLUSH_DELAY_SECS = 60
+
+MAX_ENTRIES = 500
+MIN_SCORE = 0.05
+
+# Ranking boost of the most used entries, about that of a name match
+MAX_BOOST = 10
+
+
+def decayed(score, since, now):
+    return score * 0.5 ** (max(now - since, 0) / HALF_LIFE_SECS)
+
+
+def boosted(totals, boosts):
+    """ Add the boosts to the {idx: score} map of a search, without modifying it """
+    hits = [idx for idx in boosts if idx in totals] if boosts else None
+    if not hits:
+        return totals
+    totals = dict(totals)
+    for idx in hits:
+        totals[idx] += boosts[idx]
+    return totals
+
+
+def boost(score):
+    """ Ranking boost for a frecency score, growing slowly with the number of uses """
+    return min(MAX_BOOST, 3 * math.log2(1 + score))
+
+
+class FrecencyStore:
+    """
+    How often and how recently entries were used, kept on disk across
+    restarts. Every use adds one to a score that halves every HALF_LIFE_SECS.
+
+    The store only contains keyed hashes of the account names and item ids,
+    so it doesn't tell which items exist. Uses are kept in memory and written
+    in a batch by a timer, so recording a use never waits for the disk.
+    """
+
+    def __init__(self, path=FRECENCY_FILE, flush_delay=FLUSH_DELAY_SECS):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.lock = threading.Lock()
+        self.salt = None
+        self.entries = None
+        self.dirty = False
+        self.timer = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                self.salt = bytes.fromhex(data["salt"])
+                self.entries = {key: tuple(value) for key, value in data["entries"].items()}
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                self.salt = os.urandom(16)
+                self.entries = dict()
+        return self.entries
+
+    def keys(self, account, item_ids):
+        """ The keys under which uses of the items of an account are stored """
+        with self.lock:
+            self.load()
+            salt = self.salt
+        return [
+            hashlib.blake2b("{}\0{}".format(account, item_id).encode("utf-8"), key=salt, digest_size=8).hexdigest()
+            for item_id in item_ids
+        ]
+
+    def record(self, account, item_id):
+        key = self.keys(account, [item_id])[0]
+        now = time.time()
+        with self.lock:
+            entries = self.load()
+            (score, since) = entries.get(key, (0, now))
+            entries[key] = (decayed(score, since, now) + 1, now)
+            self.dirty = True
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def scores(self):
+        """ Returns {key: current score} of all entries """
+        now = time.time()
+        with self.lock:
+            return {key: decayed(score, since, now) for key, (score, since) in self.load().items()}
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.prune()
+            data = {
+                "salt": self.salt.hex(),
+                "entries": {key: [round(score, 3), int(since)] for key, (score, since) in self.entries.items()},
+            }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Cannot save usage statistics: %s", e)
+
+    def prune(self):
+        now = time.time()
+        current = {key: decayed(score, since, now) for key, (score, since) in self.entries.items()}
+        keep = sorted((key for key in current if current[key] >= MIN_SCORE), key=current.get, reverse=True)
+        self.entries = {key: self.entries[key] for key in keep[:MAX_ENTRIES]}
+
+    def close(self):
+        with self.lock:
+            timer = self.timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
@@ -1,24 +1,44 @@
+import logging
 import os
+import threading
 
 import gi
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GLib
+from bitwarden import BitwardenCliError
+
+logger = logging.getLogger(__name__)
 
 
 class GtkPassphraseEntryWindow(Gtk.Window):
-    def __init__(self, login_mode, mfa_enabled, verify_passphrase_fn=None):
-        Gtk.Window.__init__(self, title="Bitwarden Login" if login_mode else "Bitwarden Unlock")
+    """
+    Reads the passphrase. It is verified on a worker thread, since key
+    derivation can take seconds, and the result is handed back to the GTK
+    main loop with GLib.idle_add, so the window keeps drawing meanwhile.
+    """
+
+    def __init__(self, login_mode, mfa_enabled, verify_passphrase_fn=None, account=None):
+        title = "Bitwarden Login" if login_mode else "Bitwarden Unlock"
+        if account:
+            title = "{} ({})".format(title, account)
+        Gtk.Window.__init__(self, title=title)
 
         self.set_keep_above(True)
         # self.set_icon_from_file(os.path.dirname(os.path.abspath(__file__)) + "/images/bitwarden.png")
         self.verify_passphrase_fn = verify_passphrase_fn
+        self.verifying = False
+        self.closed = False
 
         vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
         self.add(vbox)
 
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         self.pp_label = Gtk.Label("Master Password")
-        vbox.pack_start(self.pp_label, True, True, 0)
+        hbox.pack_start(self.pp_label, True, True, 0)
+        self.spinner = Gtk.Spinner()
+        hbox.pack_start(self.spinner, False, False, 0)
+        vbox.pack_start(hbox, True, True, 0)
 
         self.passphrase = ""
         self.password_entry = Gtk.Entry()
@@ -27,7 +47,6 @@ class GtkPassphraseEntryWindow(Gtk.Window):
         self.password_entry.set_visibility(False)
         self.password_entry.props.max_width_chars = 50
         self.password_entry.connect("activate", self.enter_pressed)
-        self.password_entry.connect("key-press-event", self.key_pressed)
         vbox.pack_start(self.password_entry, True, True, 0)
 
         self.mfa_label = Gtk.Label("Two Factor Authentication Code")
@@ -38,45 +57,89 @@ class GtkPassphraseEntryWindow(Gtk.Window):
         self.mfa_entry.set_visibility(True)
         self.mfa_entry.props.max_width_chars = 6
         self.mfa_entry.connect("activate", self.enter_pressed)
-        self.mfa_entry.connect("key-press-event", self.key_pressed)
         if login_mode and mfa_enabled:
             vbox.pack_start(self.mfa_label, True, True, 0)
             vbox.pack_start(self.mfa_entry, True, True, 0)
 
+        # On the window, so that Escape also works while the entries are disabled
+        self.connect("key-press-event", self.key_pressed)
         self.set_position(Gtk.WindowPosition.CENTER)
         self.set_resizable(False)
 
     def close_window(self):
+        self.closed = True
         self.destroy()
         Gtk.main_quit()
 
     def enter_pressed(self, entry):
+        if self.verifying:
+            return
         pp = self.password_entry.get_text()
         mfa = self.mfa_entry.get_text()
         if self.verify_passphrase_fn:
             self.show_verifying_passphrase()
-            if self.verify_passphrase_fn(pp, mfa):
-                self.passphrase = pp
-                self.close_window()
-            else:
-                self.show_incorrect_passphrase()
+            threading.Thread(
+                target=self.verify_passphrase, args=(pp, mfa), name="bitwarden-verify-passphrase", daemon=True
+            ).start()
         else:
             self.passphrase = pp
             self.close_window()
 
+    def verify_passphrase(self, pp, mfa):
+        """
+        Runs on the worker thread. A rejected passphrase is a False result,
+        an exception means that it could not be verified at all.
+        """
+        error = None
+        try:
+            success = self.verify_passphrase_fn(pp, mfa)
+        except BitwardenCliError as e:
+            logger.warning("Cannot verify the passphrase: %s", e.message)
+            (success, error) = (False, e.message)
+        except Exception as e:
+            logger.exception("Cannot verify the passphrase")
+            (success, error) = (False, str(e) or e.__class__.__name__)
+        GLib.idle_add(self.verification_done, pp, success, error)
+
+    def verification_done(self, pp, success, error=None):
+        """ Runs on the GTK main loop """
+        self.verifying = False
+        if self.closed:
+            return False
+        if success:
+            self.passphrase = pp
+            self.close_window()
+        elif error:
+            self.show_error(error)
+        else:
+            self.show_incorrect_passphrase()
+        return False
+
     def key_pressed(self, widget, event):
         if event.hardware_keycode == 9:
             self.passphrase = ""
             self.close_window()
 
     def show_verifying_passphrase(self):
+        self.verifying = True
         self.pp_label.set_text("Verifying passphrase...")
+        self.spinner.start()
+        self.password_entry.set_sensitive(False)
+        self.mfa_entry.set_sensitive(False)
 
     def show_incorrect_passphrase(self):
+        self.show_error("Incorrect passphrase. Please try again.")
+        self.password_entry.set_text("")
+
+    def show_error(self, message):
+        """ The passphrase is kept, the same one can be tried again """
+        self.spinner.stop()
+        self.password_entry.set_sensitive(True)
+        self.mfa_entry.set_sensitive(True)
         self.pp_label.set_markup(
-            '<span foreground="red">Incorrect passphrase. Please try again.</span>'
+            '<span foreground="red">{}</span>'.format(GLib.markup_escape_text(message))
         )
-        self.password_entry.set_text("")
+        self.password_entry.grab_focus()
 
     def read_passphrase(self):
         self.connect("destroy", Gtk.main_quit)
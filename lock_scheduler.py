@@ -0,0 +1,71 @@
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Waits are capped, so that a deadline that passed while the machine was
+# suspended is noticed soon after resume
+MAX_WAIT_SECS = 5
+
+
+class InactivityLockScheduler:
+    """
+    Calls lock_fn on its own thread as soon as the deadline passes, or when
+    woken up. Rescheduling only moves the deadline, so it is cheap enough to
+    do on every CLI call. The thread is started on first use.
+
+    lock_fn has to check again whether locking is still due, since the
+    deadline may be extended while it is being called.
+    """
+
+    def __init__(self, lock_fn, max_wait=MAX_WAIT_SECS):
+        self.lock_fn = lock_fn
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.deadline = None
+        self.woken = False
+        self.thread = None
+
+    def schedule(self, deadline):
+        """ Call lock_fn at the given datetime, None cancels """
+        with self.cond:
+            self.deadline = deadline
+            self.start()
+            self.cond.notify()
+
+    def cancel(self):
+        self.schedule(None)
+
+    def wake(self):
+        """ Call lock_fn right away """
+        with self.cond:
+            self.woken = True
+            self.start()
+            self.cond.notify()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="bitwarden-inactivity-lock", daemon=True)
+            self.thread.start()
+
+    def wait_until_due(self):
+        with self.cond:
+            while not self.woken:
+                if self.deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = (self.deadline - datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                self.cond.wait(min(remaining, self.max_wait))
+            self.woken = False
+            self.deadline = None
+
+    def run(self):
+        while True:
+            self.wait_until_due()
+            try:
+                self.lock_fn()
+            except Exception:
+                logger.exception("Inactivity lock failed")
@@ -1,3 +1,7 @@
+import os
+import signal
+import sys
+
 import gi
 
 gi.require_version("Notify", "0.7")
@@ -7,6 +11,7 @@ from ulauncher.api.client.EventListener import EventListener
 from ulauncher.api.shared.event import (
     KeywordQueryEvent,
     ItemEnterEvent,
+    PreferencesEvent,
     PreferencesUpdateEvent,
 )
 from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
@@ -16,15 +21,74 @@ from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
 from ulauncher.api.shared.action.ExtensionCustomAction import ExtensionCustomAction
 from ulauncher.api.shared.action.ActionList import ActionList
 from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
+from ulauncher.api.shared.Response import Response
 from bitwarden import (
     BitwardenClient,
     BitwardenCliNotFoundError,
     BitwardenCliError,
+    BitwardenCliCancelledError,
     BitwardenVaultLockedError)
-from gtk_passphrase_entry import GtkPassphraseEntryWindow
+from accounts import AccountManager
+from password_generator import PasswordGeneratorError, entropy_bits, generate, parse_options
+from query_worker import QueryWorker
+from result_cursor import ResultCursor
+from cli_probe import CACHE_DIR
 
 BW_CLI_MIN_VERSION = "1.20.0"
 
+PREFETCH_ENTRY_COUNT = 3
+
+GENERATED_PASSWORD_COUNT = 5
+
+# "bw @github.com" looks up logins by site instead of searching
+SITE_QUERY_PREFIX = "@"
+
+STATS_EXPORT_FILE = os.path.join(CACHE_DIR, "stats.json")
+
+LOGIN_TYPE = 1
+SECURE_NOTE_TYPE = 2
+CARD_TYPE = 3
+IDENTITY_TYPE = 4
+SSH_KEY_TYPE = 5
+
+# Attributes shown for every item type as (attribute, label, hidden)
+DETAIL_ATTRS = {
+    LOGIN_TYPE: [
+        ("password", "password", True),
+        ("username", "username", False),
+        ("uris", "URL", False),
+        ("totp", "totp", False),
+    ],
+    SECURE_NOTE_TYPE: [],
+    CARD_TYPE: [
+        ("number", "number", True),
+        ("code", "security code", True),
+        ("cardholder", "cardholder", False),
+        ("brand", "brand", False),
+        ("expiration", "expiration", False),
+    ],
+    IDENTITY_TYPE: [
+        ("name", "name", False),
+        ("username", "username", False),
+        ("email", "e-mail", False),
+        ("phone", "phone", False),
+        ("company", "company", False),
+        ("address", "address", False),
+        ("ssn", "social security number", True),
+        ("passport", "passport number", True),
+        ("license", "license number", True),
+    ],
+    SSH_KEY_TYPE: [
+        ("private_key", "private key", True),
+        ("public_key", "public key", False),
+        ("fingerprint", "fingerprint", False),
+    ],
+}
+COMMON_DETAIL_ATTRS = [
+    ("notes", "notes", False),
+    ("fields", "Custom", False),
+]
+
 SEARCH_ICON = "images/bitwarden-search.svg"
 UNLOCK_ICON = "images/bitwarden-search-locked.svg"
 EMPTY_ICON = "images/empty.png"
@@ -62,6 +126,15 @@ NO_SEARCH_RESULTS_ITEM = ExtensionResultItem(
 )
 
 
+def need_passphrase_item(account):
+    return ExtensionResultItem(
+        icon=UNLOCK_ICON,
+        name="Unlock Bitwarden ({})".format(account),
+        description="Enter passphrase to login/unlock the {} Bitwarden vault".format(account),
+        on_enter=ExtensionCustomAction({"action": "read_passphrase", "account": account}),
+    )
+
+
 def build_bitwarden_cli_version_unsupported_item(min_version):
     return ExtensionResultItem(
         icon=ERROR_ICON,
@@ -71,13 +144,13 @@ def build_bitwarden_cli_version_unsupported_item(min_version):
     )
 
 
-def more_results_available_item(cnt):
+def more_results_available_item(cnt, offset):
     return ExtensionSmallResultItem(
         icon=EMPTY_ICON,
-        name="...{} more results available, please refine the search query...".format(
+        name="...{} more results available, press Enter for the next page...".format(
             cnt
         ),
-        on_enter=DoNothingAction(),
+        on_enter=ExtensionCustomAction({"action": "next_page", "offset": offset}, keep_app_open=True),
     )
 
 
@@ -104,7 +177,7 @@ def formatted_result_item(hidden, name, value, action):
             on_enter=action,
         )
 
-def custom_clipboard_actions_list(name, value):
+def custom_clipboard_actions_list(name, value, account=None, entry=None):
     return [
         ExtensionCustomAction(
             {
@@ -112,23 +185,148 @@ def custom_clipboard_actions_list(name, value):
                 "summary": "{} copied to clipboard.".format(
                     name
                 ),
+                "account": account,
+                "entry": entry,
             }
         ),
         CopyToClipboardAction(value),
     ]
 
+def stats_items(stats):
+    data = stats.to_dict()
+    counters = data["counters"]
+    items = [
+        ExtensionResultItem(
+            icon=SEARCH_ICON,
+            name="Export statistics",
+            description="Write statistics as JSON to {}".format(STATS_EXPORT_FILE),
+            on_enter=ExtensionCustomAction({"action": "export_stats"}),
+        ),
+        ExtensionSmallResultItem(
+            icon=EMPTY_ICON,
+            name="CLI output parsed: {} kB".format(counters.get("cli.bytes_parsed", 0) // 1024),
+            on_enter=DoNothingAction(),
+        ),
+        ExtensionSmallResultItem(
+            icon=EMPTY_ICON,
+            name="Query cache: {} hits, {} prefix hits, {} misses".format(
+                counters.get("query_cache.hits", 0),
+                counters.get("query_cache.prefix_hits", 0),
+                counters.get("query_cache.misses", 0),
+            ),
+            on_enter=DoNothingAction(),
+        ),
+    ]
+    for name, histogram in data["histograms"].items():
+        items.append(
+            ExtensionResultItem(
+                icon=EMPTY_ICON,
+                name="{}: {} calls, {} errors".format(
+                    name, histogram["count"], counters.get(name + ".errors", 0)
+                ),
+                description="mean {:.0f} ms, p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms".format(
+                    histogram["mean_ms"], histogram["p50_ms"], histogram["p95_ms"],
+                    histogram["p99_ms"], histogram["max_ms"]
+                ),
+                on_enter=DoNothingAction(),
+            )
+        )
+    return items
+
+
+def generator_items(query):
+    """ Freshly generated passwords or passphrases, copied to the clipboard when selected """
+    try:
+        options = parse_options(query)
+    except PasswordGeneratorError as e:
+        return [
+            ExtensionResultItem(
+                icon=ERROR_ICON,
+                name="Invalid generator options",
+                description=e.message,
+                on_enter=DoNothingAction(),
+            )
+        ]
+    description = "Copy to clipboard, about {:.0f} bits of entropy".format(entropy_bits(options))
+    items = []
+    for _ in range(GENERATED_PASSWORD_COUNT):
+        value = generate(options)
+        items.append(
+            ExtensionResultItem(
+                icon=COPY_ICON,
+                name=value,
+                description=description,
+                on_enter=CopyToClipboardAction(value),
+            )
+        )
+    return items
+
+
+def notify_sync_result(success, error):
+    if success:
+        Notify.Notification.new("Bitwarden vault synchronized.").show()
+    elif isinstance(error, BitwardenCliError):
+        Notify.Notification.new("Error", "Bitwarden vault synchronization error: {}".format(error.message)).show()
+    else:
+        Notify.Notification.new("Error", "Bitwarden vault synchronization error.").show()
+
+def build_search_results(accounts, keyword, total, results, extension, offset=0):
+    """ Result items of a page of search results, starting at offset """
+    items = []
+    if not results:
+        items.append(NO_SEARCH_RESULTS_ITEM)
+    else:
+        tag_accounts = accounts.has_additional()
+        extension.set_rendered_entries(results)
+        for r in results:
+            e = r.entry
+            action = ExtensionCustomAction(
+                {"action": "activate_entry", "id": e.id, "account": r.account, "keyword": keyword},
+                keep_app_open=True,
+            )
+            description = accounts.get(r.account).get_folder(e.folder_id)
+            if tag_accounts:
+                description = "[{}] {}".format(r.account, description)
+            items.append(
+                ExtensionResultItem(
+                    icon=ITEM_ICON,
+                    name=e.name,
+                    description=description,
+                    on_enter=action,
+                )
+            )
+        shown = offset + len(results)
+        if total > shown:
+            items.append(more_results_available_item(total - shown, shown))
+        prefetch = dict()
+        for r in results[:PREFETCH_ENTRY_COUNT]:
+            prefetch.setdefault(r.account, []).append(r.entry.id)
+        for account, ids in prefetch.items():
+            accounts.get(account).prefetch_entry_details(ids)
+    if accounts.has_additional():
+        items.extend(need_passphrase_item(name) for name in accounts.locked())
+    return RenderResultListAction(items)
+
+
 class BitwardenExtension(Extension):
     """ Extension class, coordinates everything """
 
     def __init__(self):
         super(BitwardenExtension, self).__init__()
         self.bitwarden = BitwardenClient()
-        self.subscribe(KeywordQueryEvent, KeywordQueryEventListener(self.bitwarden))
-        self.subscribe(ItemEnterEvent, ItemEnterEventListener(self.bitwarden))
+        self.accounts = AccountManager(self.bitwarden)
+        self.query_worker = QueryWorker(cancel_fn=self.accounts.cancel_processes)
+        self.subscribe(KeywordQueryEvent, KeywordQueryEventListener(self.accounts))
+        self.subscribe(ItemEnterEvent, ItemEnterEventListener(self.accounts))
+        self.subscribe(PreferencesEvent, PreferencesEventListener(self.accounts))
         self.subscribe(
-            PreferencesUpdateEvent, PreferencesUpdateEventListener(self.bitwarden)
+            PreferencesUpdateEvent, PreferencesUpdateEventListener(self.accounts)
         )
         self.active_entry = None
+        self.rendered_entries = dict()
+        self.result_cursor = None
+        # Listeners of the primary client are shared by all accounts
+        self.bitwarden.add_lock_listener(self.forget_results)
 
     def get_search_keyword(self):
         return self.preferences["search"]
@@ -139,6 +337,12 @@ class BitwardenExtension(Extension):
     def get_lock_keyword(self):
         return self.preferences["lock"]
 
+    def get_stats_keyword(self):
+        return self.preferences["stats"]
+
+    def get_generate_keyword(self):
+        return self.preferences["generate"]
+
     def get_server_url(self):
         return self.preferences["server-url"]
 
@@ -157,173 +361,337 @@ class BitwardenExtension(Extension):
     def get_session_store_cmd(self):
         return self.preferences["session-store-cmd"]
 
+    def get_serve_enabled(self):
+        return self.preferences["serve-backend"] == 'yes'
+
+    def get_native_enabled(self):
+        return self.preferences["native-backend"] == 'yes'
+
     def set_active_entry(self, keyword, entry):
         self.active_entry = (keyword, entry)
 
+    def set_rendered_entries(self, results):
+        """
+        Remember the rendered entries, so that item actions only need to
+        carry account names and entry ids.
+        """
+        self.rendered_entries = {(r.account, r.entry.id): r.entry for r in results}
+
+    def get_rendered_entry(self, account, entry_id):
+        return self.rendered_entries.get((account, entry_id))
+
+    def set_result_cursor(self, cursor):
+        self.result_cursor = cursor
+
+    def get_result_cursor(self):
+        return self.result_cursor
+
+    def forget_results(self):
+        """ Called when a vault is locked, the entries shown before must not be used anymore """
+        self.result_cursor = None
+        self.rendered_entries = dict()
+        self.active_entry = None
+
+    def respond(self, event, action):
+        """ Send an action computed outside of the event listener back to Ulauncher """
+        self._client.send(Response(event, action))
+
 
 class KeywordQueryEventListener(EventListener):
     """ KeywordQueryEventListener class used to manage user input """
 
-    def __init__(self, bitwarden):
-        self.bitwarden = bitwarden
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.bitwarden = accounts.primary
 
     def on_event(self, event, extension):
+        """
+        Queries are answered on the query worker thread. Only searches can
+        be cancelled by newer input, sync and lock always run to completion.
+        Passwords are generated right away, they never wait for the CLI.
+        """
+        if event.get_keyword() == extension.get_generate_keyword():
+            return RenderResultListAction(generator_items(event.get_argument()))
+        extension.query_worker.submit(
+            lambda: self.handle_query(event, extension),
+            lambda action: extension.respond(event, action),
+            cancellable=event.get_keyword() == extension.get_search_keyword(),
+        )
+
+    def handle_query(self, event, extension):
+        if event.get_keyword() == extension.get_stats_keyword():
+            return RenderResultListAction(stats_items(self.bitwarden.stats))
+        with self.bitwarden.stats.timer("listener.keyword_query"):
+            return self.answer_query(event, extension)
+
+    def answer_query(self, event, extension):
         try:
             self.bitwarden.initialize(
                 extension.get_server_url(),
                 extension.get_email(),
                 extension.get_mfa_enabled(),
                 extension.get_inactivity_lock_timeout(),
-                extension.get_session_store_cmd()
+                extension.get_session_store_cmd(),
+                extension.get_serve_enabled(),
+                extension.get_native_enabled()
+            )
+            self.accounts.initialize(
+                extension.get_mfa_enabled(),
+                extension.get_inactivity_lock_timeout(),
+                extension.get_serve_enabled(),
+                extension.get_native_enabled()
             )
 
-            if not self.bitwarden.has_session():
-                if self.bitwarden.get_bw_version() < BW_CLI_MIN_VERSION:
+            if not self.accounts.unlocked():
+                if not self.bitwarden.is_cli_version_supported(BW_CLI_MIN_VERSION):
                     return RenderResultListAction([build_bitwarden_cli_version_unsupported_item(BW_CLI_MIN_VERSION)])
                 else:
-                    return RenderResultListAction([NEED_PASSPHRASE_ITEM])
+                    return RenderResultListAction(self.unlock_items())
             else:
                 return self.process_keyword_query(event, extension)
+        except BitwardenCliCancelledError:
+            return None
         except BitwardenVaultLockedError:
             return RenderResultListAction([NEED_PASSPHRASE_ITEM])
         except BitwardenCliNotFoundError:
+            self.bitwarden.stats.increment("listener.keyword_query.errors")
             return RenderResultListAction([BITWARDEN_CLI_NOT_FOUND_ITEM])
         except BitwardenCliError as e:
+            self.bitwarden.stats.increment("listener.keyword_query.errors")
             return RenderResultListAction([bitwarden_cli_error_item(e.message)])
 
-    def render_search_results(self, keyword, entries, extension):
-        max_items = extension.get_max_result_items()
-        items = []
-        if not entries:
-            items.append(NO_SEARCH_RESULTS_ITEM)
-        else:
-            for e in entries[:max_items]:
-                action = ExtensionCustomAction(
-                    {"action": "activate_entry", "entry": e, "keyword": keyword},
-                    keep_app_open=True,
-                )
-                items.append(
-                    ExtensionResultItem(
-                        icon=ITEM_ICON,
-                        name=e["name"],
-                        description=self.bitwarden.get_folder(e["folderId"]),
-                        on_enter=action,
-                    )
-                )
-            if len(entries) > max_items:
-                items.append(more_results_available_item(len(entries) - max_items))
-        return RenderResultListAction(items)
+    def unlock_items(self):
+        """ Unlock items of all locked accounts, the primary one only needs the plain unlock item """
+        if not self.accounts.has_additional():
+            return [NEED_PASSPHRASE_ITEM]
+        return [need_passphrase_item(name) for name in self.accounts.locked()]
+
+    def render_search_results(self, keyword, total, results, extension):
+        with self.bitwarden.stats.timer("render.search_results"):
+            return build_search_results(self.accounts, keyword, total, results, extension)
 
     def process_keyword_query(self, event, extension):
         query_keyword = event.get_keyword()
         query_arg = event.get_argument()
 
         if query_keyword == extension.get_search_keyword():
+            # The next pages of the previous query are of no use anymore
+            extension.set_result_cursor(None)
             if not query_arg:
-                return RenderResultListAction([ENTER_QUERY_ITEM])
+                matches = self.accounts.frecent()
+            elif query_arg.startswith(SITE_QUERY_PREFIX):
+                matches = self.accounts.search_site(query_arg[len(SITE_QUERY_PREFIX):].strip())
             else:
-                entries = self.bitwarden.search(query_arg)
-                return self.render_search_results(query_keyword, entries, extension)
+                matches = self.accounts.search(query_arg)
+            results = matches.top(extension.get_max_result_items())
+            if not query_arg and not results:
+                return RenderResultListAction([ENTER_QUERY_ITEM])
+            if matches.total > len(results):
+                extension.set_result_cursor(ResultCursor(query_keyword, matches, results))
+            return self.render_search_results(query_keyword, matches.total, results, extension)
         elif query_keyword == extension.get_sync_keyword():
-            if self.bitwarden.sync():
-                Notify.Notification.new("Bitwarden vault synchronized.").show()
-            else:
-                Notify.Notification.new("Error", "Bitwarden vault synchronization error.").show()
+            started = [client.sync_in_background(notify_sync_result) for _, client in self.accounts.unlocked()]
+            if any(started):
+                Notify.Notification.new("Bitwarden vault synchronization started.").show()
         elif query_keyword == extension.get_lock_keyword():
-            if self.bitwarden.lock():
+            extension.set_result_cursor(None)
+            errors = []
+            for name, client in self.accounts.unlocked():
+                # One account failing to lock must not keep the others unlocked
+                try:
+                    client.lock()
+                except BitwardenCliError as e:
+                    errors.append("{} ({})".format(e.message, name) if self.accounts.has_additional() else e.message)
+            if not errors:
                 Notify.Notification.new("Bitwarden vault locked.").show()
             else:
-                Notify.Notification.new("Error", "Bitwarden vault locking error.").show()
+                Notify.Notification.new("Error", "Bitwarden vault locking error: {}".format("; ".join(errors))).show()
 
 
 class ItemEnterEventListener(EventListener):
     """ KeywordQueryEventListener class used to manage user input """
 
-    def __init__(self, bitwarden):
-        self.bitwarden = bitwarden
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.bitwarden = accounts.primary
 
     def on_event(self, event, extension):
+        data = event.get_data()
+        if data.get("action", None) == "read_passphrase":
+            # Not timed, it waits for the user to type the passphrase
+            return self.handle_action(data, extension)
+        with self.bitwarden.stats.timer("listener.item_enter"):
+            return self.handle_action(data, extension)
+
+    def handle_action(self, data, extension):
         try:
-            data = event.get_data()
             action = data.get("action", None)
+            account = data.get("account", None)
+            bitwarden = self.accounts.get(account)
+            if bitwarden is None:
+                # The account has been removed from the preferences
+                return None
             if action == "read_passphrase":
-                return self.read_verify_passphrase(extension)
+                self.read_verify_passphrase(bitwarden)
+                self.accounts.warm_frecent(account)
             elif action == "activate_entry":
                 keyword = data.get("keyword", None)
-                entry = data.get("entry", None)
-                extension.set_active_entry(keyword, entry)
-                return self.show_active_entry(entry["id"])
+                entry_id = data.get("id", None)
+                extension.set_active_entry(keyword, extension.get_rendered_entry(account, entry_id))
+                self.accounts.record_use(account, entry_id)
+                return self.show_active_entry(bitwarden, account, entry_id)
+            elif action == "next_page":
+                return self.show_next_page(data.get("offset", 0), extension)
             elif action == "show_notification":
+                if data.get("entry"):
+                    self.accounts.record_use(account, data["entry"])
                 Notify.Notification.new(data.get("summary")).show()
+            elif action == "copy_totp":
+                self.accounts.record_use(account, data.get("entry"))
+                return self.copy_totp(bitwarden, data.get("entry"))
+            elif action == "export_stats":
+                self.export_stats()
         except BitwardenCliNotFoundError:
+            self.bitwarden.stats.increment("listener.item_enter.errors")
             return RenderResultListAction([BITWARDEN_CLI_NOT_FOUND_ITEM])
         except BitwardenCliError as e:
+            self.bitwarden.stats.increment("listener.item_enter.errors")
             return RenderResultListAction([bitwarden_cli_error_item(e.message)])
 
-    def read_verify_passphrase(self, extension):
+    def show_next_page(self, offset, extension):
+        """ The page of the last search starting at offset, from the result cursor """
+        cursor = extension.get_result_cursor()
+        if cursor is None:
+            # The query changed or a vault was locked
+            if not self.accounts.unlocked():
+                return RenderResultListAction([NEED_PASSPHRASE_ITEM])
+            return None
+        (total, results) = cursor.page(offset, extension.get_max_result_items())
+        return build_search_results(self.accounts, cursor.keyword, total, results, extension, offset)
+
+    def export_stats(self):
+        try:
+            self.bitwarden.stats.export(STATS_EXPORT_FILE)
+            Notify.Notification.new("Statistics exported to {}".format(STATS_EXPORT_FILE)).show()
+        except OSError as e:
+            Notify.Notification.new("Error", "Cannot export statistics: {}".format(e)).show()
+
+    def read_verify_passphrase(self, bitwarden):
+        # Gtk is slow to import, and only needed when the vault has to be unlocked
+        from gtk_passphrase_entry import GtkPassphraseEntryWindow
+
         win = GtkPassphraseEntryWindow(
-            login_mode=self.bitwarden.need_login(),
-            mfa_enabled=self.bitwarden.need_mfa(),
-            verify_passphrase_fn=self.bitwarden.verify_and_set_passphrase
+            login_mode=bitwarden.need_login(),
+            mfa_enabled=bitwarden.need_mfa(),
+            verify_passphrase_fn=bitwarden.verify_and_set_passphrase,
+            account=bitwarden.email if self.accounts.has_additional() else None
         )
         win.read_passphrase()
-        if not self.bitwarden.need_unlock():
+        if not bitwarden.need_unlock():
             Notify.Notification.new("Bitwarden vault unlocked.").show()
 
-    def show_active_entry(self, entry):
+    def copy_totp(self, bitwarden, entry):
+        code = bitwarden.get_totp(entry)
+        Notify.Notification.new("Totp copied to clipboard.").show()
+        return CopyToClipboardAction(code)
+
+    def show_active_entry(self, bitwarden, account, entry):
         items = []
-        details = self.bitwarden.get_entry_details(entry)
-        attrs = [
-            ("password", "password"),
-            ("username", "username"),
-            ("uri", "URL"),
-            ("totp", "totp"),
-            ("fields", "Custom")
-        ]
-        for attr, attr_nice in attrs:
+        details = bitwarden.get_entry_details(entry)
+        attrs = DETAIL_ATTRS.get(details.get("type"), DETAIL_ATTRS[LOGIN_TYPE]) + COMMON_DETAIL_ATTRS
+        for attr, attr_nice, hidden in attrs:
             val = details.get(attr, "")
             if val:
-                if attr == "fields":
+                if attr == "uris":
+                    for uri in val:
+                        action = ActionList(custom_clipboard_actions_list(attr_nice, uri, account, entry))
+                        items.append(formatted_result_item(False, attr_nice, uri, action))
+                elif attr == "fields":
                     for field in val:
                         action = ActionList(
-                            custom_clipboard_actions_list(field["name"], field["value"])
+                            custom_clipboard_actions_list(field["name"], field["value"], account, entry)
                         )
 
                         if field["type"] == 1:
                             items.append(formatted_result_item(True, field["name"], field["value"], action))
                         else:
                             items.append(formatted_result_item(False, field["name"], field["value"], action))
+                elif attr == "totp":
+                    # The code is generated again when copied, so it is never stale
+                    action = ExtensionCustomAction({"action": "copy_totp", "entry": entry, "account": account})
+                    if "totp_remaining" in details:
+                        val = "{} ({}s left)".format(val, details["totp_remaining"])
                 else:
                     action = ActionList(
-                        custom_clipboard_actions_list(attr_nice.capitalize(), val)
+                        custom_clipboard_actions_list(attr_nice.capitalize(), val, account, entry)
                     )
+                    # Only the first line of multi-line values, like notes, fits into a result item
+                    lines = val.splitlines() or [""]
+                    val = lines[0] + (" ..." if len(lines) > 1 else "")
 
-                if attr == "password":
-                    items.append(formatted_result_item(True, attr_nice.capitalize(), val, action))
-                elif attr != "fields":
-                    items.append(formatted_result_item(False, attr_nice.capitalize(), val, action))
+                if attr not in ("fields", "uris"):
+                    items.append(formatted_result_item(hidden, attr_nice.capitalize(), val, action))
         return RenderResultListAction(items)
 
 
+class PreferencesEventListener(EventListener):
+    """ Set up the accounts and probe the CLI as soon as preferences are loaded at startup """
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.bitwarden = accounts.primary
+
+    def on_event(self, event, extension):
+        self.bitwarden.warm_up(event.preferences["server-url"])
+        self.accounts.configure(event.preferences.get("accounts", ""))
+        for name, client in self.accounts.additional():
+            client.warm_up(self.accounts.profiles[name].server)
+
+
 class PreferencesUpdateEventListener(EventListener):
     """ Handle preferences updates """
 
-    def __init__(self, bitwarden):
-        self.bitwarden = bitwarden
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.bitwarden = accounts.primary
 
     def on_event(self, event, extension):
+        with self.bitwarden.stats.timer("listener.preferences_update"):
+            self.update_preference(event)
+
+    def update_preference(self, event):
+        """ Server url, e-mail and session store command only apply to the primary account """
         if event.new_value != event.old_value:
+            clients = [client for _, client in self.accounts.all()]
+            for client in clients:
+                client.query_cache.clear()
             if event.id == "server-url":
                 self.bitwarden.change_server_url(event.new_value)
             elif event.id == "email":
                 self.bitwarden.change_email(event.new_value)
             elif event.id == "inactivity-lock-timeout":
-                self.bitwarden.change_inactivity_lock_timeout(int(event.new_value))
+                for client in clients:
+                    client.change_inactivity_lock_timeout(int(event.new_value))
             elif event.id == "session-store-cmd":
                 self.bitwarden.change_session_store_cmd(event.new_value)
+            elif event.id == "serve-backend":
+                for client in clients:
+                    client.change_serve_enabled(event.new_value == 'yes')
+            elif event.id == "native-backend":
+                for client in clients:
+                    client.change_native_enabled(event.new_value == 'yes')
+            elif event.id == "accounts":
+                self.accounts.configure(event.new_value)
 
 
 if __name__ == "__main__":
     Notify.init("ulauncher-bitwarden")
-    BitwardenExtension().run()
+    extension = BitwardenExtension()
+    # Ulauncher stops extensions with SIGTERM, exit through the finally
+    # block so that `bw serve` is stopped and pending usage is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        extension.run()
+    finally:
+        extension.accounts.close()
     Notify.uninit()
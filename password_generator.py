@@ -0,0 +1,159 @@
+import math
+import os
+import secrets
+import shlex
+import threading
+from collections import namedtuple
+
+WORDLIST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists", "eff_large_wordlist.txt")
+
+# Character sets of the Bitwarden generator. Ambiguous characters are left
+# out unless asked for, like `bw generate` does.
+UPPERCASE = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+LOWERCASE = "abcdefghijkmnopqrstuvwxyz"
+NUMBERS = "23456789"
+SPECIAL = "!@#$%^&*"
+AMBIGUOUS = {UPPERCASE: "IO", LOWERCASE: "l", NUMBERS: "01", SPECIAL: ""}
+
+DEFAULT_LENGTH = 14
+MIN_LENGTH = 5
+MAX_LENGTH = 128
+DEFAULT_WORDS = 3
+MIN_WORDS = 3
+MAX_WORDS = 20
+DEFAULT_SEPARATOR = "-"
+
+GeneratorOptions = namedtuple("GeneratorOptions", [
+    "passphrase", "uppercase", "lowercase", "number", "special", "ambiguous", "length",
+    "words", "separator", "capitalize", "include_number",
+])
+
+wordlist = None
+wordlist_lock = threading.Lock()
+
+
+class PasswordGeneratorError(Exception):
+    """ The generator options can't be used """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def load_wordlist(path=WORDLIST_FILE):
+    """ The EFF large wordlist, as published with dice rolls before every word """
+    global wordlist
+    with wordlist_lock:
+        if wordlist is None:
+            with open(path, "r") as f:
+                wordlist = [line.split()[-1] for line in f if line.strip()]
+        return wordlist
+
+
+def parse_int(value, name, low, high):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise PasswordGeneratorError("{} must be a number".format(name))
+    if not low <= number <= high:
+        raise PasswordGeneratorError("{} must be between {} and {}".format(name, low, high))
+    return number
+
+
+def parse_options(query):
+    """
+    Parse the options of `bw generate` from the query, e.g. "-uln --length 20"
+    or "-p --words 4 --separator _ -c --includeNumber". A plain number is the
+    length, or the word count of passphrases.
+    """
+    try:
+        args = shlex.split(query or "")
+    except ValueError as e:
+        raise PasswordGeneratorError(str(e))
+
+    flags = set()
+    values = dict()
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        if arg in ("--length", "--words", "--separator"):
+            if idx + 1 == len(args):
+                raise PasswordGeneratorError("{} needs a value".format(arg))
+            values[arg[2:]] = args[idx + 1]
+            idx += 1
+        elif arg in ("--uppercase", "--lowercase", "--number", "--special", "--passphrase",
+                     "--capitalize", "--includeNumber", "--ambiguous"):
+            flags.add(arg[2:])
+        elif arg.startswith("-") and len(arg) > 1 and not arg.startswith("--") and set(arg[1:]) <= set("ulnspc"):
+            flags.update({"u": "uppercase", "l": "lowercase", "n": "number", "s": "special",
+                          "p": "passphrase", "c": "capitalize"}[c] for c in arg[1:])
+        elif arg.isdigit():
+            values["count"] = arg
+        else:
+            raise PasswordGeneratorError("Unknown option {}".format(arg))
+        idx += 1
+
+    passphrase = "passphrase" in flags
+    classes = {c for c in ("uppercase", "lowercase", "number", "special") if c in flags}
+    if not classes:
+        # The defaults of `bw generate`
+        classes = {"uppercase", "lowercase", "number"}
+    length = values.get("length", values.get("count") if not passphrase else None)
+    words = values.get("words", values.get("count") if passphrase else None)
+    return GeneratorOptions(
+        passphrase=passphrase,
+        uppercase="uppercase" in classes,
+        lowercase="lowercase" in classes,
+        number="number" in classes,
+        special="special" in classes,
+        ambiguous="ambiguous" in flags,
+        length=parse_int(length, "Length", MIN_LENGTH, MAX_LENGTH) if length is not None else DEFAULT_LENGTH,
+        words=parse_int(words, "Word count", MIN_WORDS, MAX_WORDS) if words is not None else DEFAULT_WORDS,
+        separator=values.get("separator", DEFAULT_SEPARATOR),
+        capitalize="capitalize" in flags,
+        include_number="includeNumber" in flags,
+    )
+
+
+def character_sets(options):
+    sets = [s for s, enabled in ((UPPERCASE, options.uppercase), (LOWERCASE, options.lowercase),
+                                 (NUMBERS, options.number), (SPECIAL, options.special)) if enabled]
+    if options.ambiguous:
+        sets = [s + AMBIGUOUS[s] for s in sets]
+    return sets
+
+
+def generate_password(options):
+    """ A password with at least one character of every enabled class """
+    sets = character_sets(options)
+    alphabet = "".join(sets)
+    chars = [secrets.choice(s) for s in sets]
+    chars.extend(secrets.choice(alphabet) for _ in range(options.length - len(chars)))
+    secrets.SystemRandom().shuffle(chars)
+    return "".join(chars)
+
+
+def generate_passphrase(options):
+    words = load_wordlist()
+    chosen = [secrets.choice(words) for _ in range(options.words)]
+    if options.capitalize:
+        chosen = [word.capitalize() for word in chosen]
+    if options.include_number:
+        idx = secrets.randbelow(len(chosen))
+        chosen[idx] += str(secrets.randbelow(10))
+    return options.separator.join(chosen)
+
+
+def generate(options):
+    if options.passphrase:
+        return generate_passphrase(options)
+    return generate_password(options)
+
+
+def entropy_bits(options):
+    """ Strength of the generated values, ignoring the guaranteed character classes """
+    if options.passphrase:
+        bits = options.words * math.log2(len(load_wordlist()))
+        if options.include_number:
+            bits += math.log2(10 * options.words)
+        return bits
+    return options.length * math.log2(len("".join(character_sets(options))))
@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from vault_index import tokenize
+
+CachedMatch = namedtuple("CachedMatch", ["totals", "fuzzy"])
+
+# Rescoring candidates one by one is slower than matching through the index
+# once there are more than a few hundred of them
+MAX_PREFIX_CANDIDATES = 500
+
+
+def normalize_query(query):
+    return " ".join(tokenize(query))
+
+
+def extends(key, cached_key):
+    """
+    Whether every match of key is also a match of cached_key. Terms shorter
+    than 3 characters only match token prefixes, longer ones match anywhere
+    in a token, so a short last term can only be followed by a new term.
+    """
+    if not key.startswith(cached_key) or key == cached_key:
+        return False
+    last_term = cached_key.rsplit(" ", 1)[-1]
+    return len(last_term) >= 3 or key[len(cached_key)] == " "
+
+
+class QueryCache:
+    """
+    LRU cache of search matches, keyed by normalized query.
+
+    When the user keeps typing, the new query usually extends a cached one.
+    Its matches are then a subset of the cached matches, so only those are
+    scored instead of the whole index, as long as there are few of them.
+    Matches found by fuzzy matching are not used that way, since they don't
+    have this property.
+
+    The cache belongs to one index; searching a different one clears it.
+    """
+
+    def __init__(self, size, stats):
+        self.size = size
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.index = None
+        self.entries = OrderedDict()
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+            self.entries.clear()
+
+    def lookup(self, index, key):
+        """ Returns (exact match or None, longest cached prefix match or None) """
+        with self.lock:
+            if index is not self.index:
+                self.index = index
+                self.entries.clear()
+                return None, None
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                return cached, None
+            prefix = None
+            for cached_key, cached_match in self.entries.items():
+                if extends(key, cached_key) and (prefix is None or len(cached_key) > len(prefix[0])):
+                    prefix = (cached_key, cached_match)
+            return None, prefix[1] if prefix else None
+
+    def put(self, index, key, match):
+        with self.lock:
+            if index is not self.index:
+                return
+            self.entries[key] = match
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def search(self, index, query, limit=None):
+        return index.rank(self.match(index, query).totals, limit)
+
+    def match(self, index, query):
+        key = normalize_query(query)
+        (cached, prefix) = self.lookup(index, key)
+        if cached is not None:
+            self.stats.increment("query_cache.hits")
+            return cached
+
+        match = None
+        if prefix is not None and not prefix.fuzzy and len(prefix.totals) <= MAX_PREFIX_CANDIDATES:
+            totals = index.match(query, prefix.totals)[0]
+            if totals:
+                self.stats.increment("query_cache.prefix_hits")
+                match = CachedMatch(totals, False)
+        if match is None:
+            self.stats.increment("query_cache.misses")
+            match = CachedMatch(*index.match(query))
+        self.put(index, key, match)
+        return match
@@ -0,0 +1,91 @@
+import re
+
+from vault_index import normalize, tokenize
+
+# Filters of the query language, e.g. `f:work t:card u:alice org:acme github`.
+# Values with spaces are quoted: `f:"side projects"`.
+FILTER_KEYS = {
+    "f": "folder",
+    "t": "type",
+    "u": "username",
+    "org": "organization",
+    "c": "collection",
+    "col": "collection",
+}
+
+FILTER_RE = re.compile(r'(?<!\S)(f|t|u|org|c|col):(?:"([^"]*)"|(\S+))')
+
+ITEM_TYPES = {
+    "login": 1,
+    "note": 2,
+    "securenote": 2,
+    "card": 3,
+    "identity": 4,
+    "ssh": 5,
+    "sshkey": 5,
+}
+
+
+def parse_query(query):
+    """ "f:work t:card github" -> ([("folder", "work"), ("type", "card")], "github") """
+    filters = []
+
+    def take(match):
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        filters.append((FILTER_KEYS[match.group(1)], normalize(value).strip()))
+        return ""
+
+    text = FILTER_RE.sub(take, query)
+    return filters, " ".join(text.split())
+
+
+def ids_by_name(names, value):
+    """ Ids of the folders, organizations or collections whose name starts with the value """
+    return [name_id for name_id, name in names.items() if normalize(name).startswith(value)]
+
+
+def filter_candidates(index, snapshot, filters):
+    """
+    Compile the filters into the set of matching item positions of the
+    index: every filter is a union of posting lists, and the filters are
+    intersected, smallest first.
+    """
+    postings = index.get_filter_postings()
+    matched = []
+    for kind, value in filters:
+        if kind == "type":
+            sets = [postings.types.get(t, ()) for t in {t for name, t in ITEM_TYPES.items() if name.startswith(value)}]
+        elif kind == "folder":
+            sets = [postings.folders.get(i, ()) for i in ids_by_name(snapshot.folders, value)]
+        elif kind == "organization":
+            sets = [postings.organizations.get(i, ()) for i in ids_by_name(snapshot.organizations, value)]
+        elif kind == "collection":
+            sets = [postings.collections.get(i, ()) for i in ids_by_name(snapshot.collections, value)]
+        else:
+            terms = tokenize(value)
+            sets = [set.intersection(*[index.username_matches(term) for term in terms])] if terms else []
+        matched.append(set().union(*sets))
+
+    matched.sort(key=len)
+    candidates = set(matched[0])
+    for other in matched[1:]:
+        candidates &= other
+        if not candidates:
+            break
+    return candidates
+
+
+def entry_matches(entry, filters):
+    """
+    Check the filters that can be checked on an entry alone, for results
+    of the CLI when there is no snapshot. Other filters are ignored.
+    """
+    for kind, value in filters:
+        if kind == "type":
+            if not any(name.startswith(value) and t == entry.type for name, t in ITEM_TYPES.items()):
+                return False
+        elif kind == "username":
+            tokens = tokenize(entry.username)
+            if not all(any(token.startswith(term) for token in tokens) for term in tokenize(value)):
+                return False
+    return True
@@ -0,0 +1,65 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class QueryWorker:
+    """
+    Runs keyword queries on a single worker thread.
+
+    Every submitted query gets a new generation number. A cancellable
+    query that is still waiting is replaced by a newer one, an in-flight
+    cancellable query is aborted through the cancel function, and only the
+    result of the newest generation is passed to its respond callback.
+    Queries that aren't cancellable, like lock and sync, stay queued until
+    they have run.
+    """
+
+    def __init__(self, cancel_fn=None):
+        self.cancel_fn = cancel_fn
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.pending = deque()
+        self.running_cancellable = False
+        self.thread = threading.Thread(target=self.run, name="bitwarden-query", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, respond, cancellable=True):
+        with self.condition:
+            self.generation += 1
+            waiting = [job for job in self.pending if not job[3]]
+            self.pending.clear()
+            self.pending.extend(waiting)
+            self.pending.append((self.generation, fn, respond, cancellable))
+            # Cancel while holding the condition, so that the worker can't
+            # pick up the new query and have it cancelled instead
+            if self.running_cancellable and self.cancel_fn:
+                self.cancel_fn(self.thread.ident)
+            self.condition.notify()
+
+    def is_current(self, generation):
+        with self.condition:
+            return generation == self.generation
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                generation, fn, respond, cancellable = self.pending.popleft()
+                self.running_cancellable = cancellable
+
+            try:
+                result = fn()
+            except Exception:
+                if self.is_current(generation):
+                    logger.exception("Query failed")
+                result = None
+            finally:
+                with self.condition:
+                    self.running_cancellable = False
+
+            if result is not None and self.is_current(generation):
+                respond(result)
@@ -0,0 +1,24 @@
+class ResultCursor:
+    """
+    The results of the last search, to page through them without searching
+    again. Only the first page is ranked at first. When the user moves past
+    it, all matches the search found are ranked once and kept, later pages
+    are slices of them.
+
+    The extension drops the cursor when a vault is locked, see
+    BitwardenExtension.forget_results().
+    """
+
+    def __init__(self, keyword, matches, results):
+        self.keyword = keyword
+        self.matches = matches
+        self.total = matches.total
+        self.results = results
+        self.complete = len(results) >= self.total
+
+    def page(self, offset, limit):
+        """ Returns (total, results from offset on, at most limit of them) """
+        if not self.complete and offset + limit > len(self.results):
+            self.results = self.matches.top(self.total)
+            self.complete = True
+        return self.total, self.results[offset:offset + limit]
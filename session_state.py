@@ -0,0 +1,45 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = "unknown"
+LOGGED_OUT = "logged-out"
+LOCKED = "locked"
+UNLOCKED = "unlocked"
+EXPIRED = "expired"
+
+LOGGED_IN_STATES = (LOCKED, UNLOCKED, EXPIRED)
+
+
+class SessionStateTracker:
+    """
+    What the extension knows about the CLI session. The state is updated by
+    the results of login, unlock, lock and logout, so that the CLI only has
+    to be probed with `bw login --check` while it is unknown.
+
+    EXPIRED is a vault locked by the inactivity timeout.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = UNKNOWN
+
+    def get(self):
+        with self.lock:
+            return self.state
+
+    def set(self, state):
+        with self.lock:
+            if state != self.state:
+                logger.debug("Session state %s -> %s", self.state, state)
+                self.state = state
+
+    def is_known(self):
+        return self.get() != UNKNOWN
+
+    def is_logged_in(self):
+        return self.get() in LOGGED_IN_STATES
+
+    def is_unlocked(self):
+        return self.get() == UNLOCKED
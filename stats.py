@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+SUBCOMMANDS_WITH_OBJECT = ("list", "get", "config")
+
+
+def command_name(args):
+    """ Name of a CLI command for statistics, e.g. "list items". Never contains arguments like ids or queries. """
+    if not args:
+        return "bw"
+    if args[0] in SUBCOMMANDS_WITH_OBJECT and len(args) > 1:
+        return "{} {}".format(args[0], args[1])
+    return args[0]
+
+
+class Histogram:
+    """ Latency histogram with fixed millisecond buckets """
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, secs):
+        ms = secs * 1000
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """ Upper bound of the bucket containing the p-th percentile """
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for idx, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(HISTOGRAM_BOUNDS_MS[idx], self.max) if idx < len(HISTOGRAM_BOUNDS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max,
+            "buckets_ms": dict(zip([str(b) for b in HISTOGRAM_BOUNDS_MS] + ["inf"], self.buckets)),
+        }
+
+
+class Stats:
+    """ Timing histograms and counters of CLI calls and event listeners """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.histograms = dict()
+        self.counters = dict()
+
+    def record_time(self, name, secs):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(secs)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.histograms = dict()
+            self.counters = dict()
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "exported_at": time.time(),
+                "histograms": {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
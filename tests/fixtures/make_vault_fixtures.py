@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Writes the data.json fixtures of test_vault_decrypt.py, one for each
+layout the CLI has used, encrypted the way the Bitwarden clients do:
+
+- flat.json: "user_<id>_..." state keys of current CLI versions, the user
+  key protected by the session key as __PROTECTED__<id>_user_auto
+- account.json: the per-account layout of older CLI versions, with the
+  master key protected as __PROTECTED__<id>_masterkey_auto and the user
+  key encrypted with the stretched master key
+
+The session key of both is in session.txt. Keys are derived from fixed
+seeds, so only the IVs and the RSA key differ between runs.
+
+    python3 tests/fixtures/make_vault_fixtures.py
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+
+from cryptography.hazmat.primitives import hashes, padding, serialization
+from cryptography.hazmat.primitives.asymmetric import padding as rsa_padding
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(FIXTURES_DIR)))
+
+from vault_decrypt import SymmetricKey  # noqa: E402
+
+USER_ID = "7b0a5e5c-3d57-4c3e-9d2b-1f1f0c6c0001"
+ORG_ID = "0f4c7d52-9a61-4a55-8d7b-6e5b3c2a0002"
+FOLDER_ID = "5d2d1f8e-1b7c-4f0a-9c3e-2a9b8c7d0003"
+COLLECTION_ID = "a3e1c4b2-6d5f-4e7a-8b9c-0d1e2f3a0004"
+
+
+def seeded(name, length):
+    return hashlib.sha512(name.encode("utf-8")).digest()[:length]
+
+
+SESSION_KEY = seeded("session", 64)
+USER_KEY = seeded("user", 64)
+MASTER_KEY = seeded("master", 32)
+ORG_KEY = seeded("organization", 64)
+ITEM_KEY = seeded("item", 64)
+
+
+def aes_encrypt(key, plain):
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(plain) + padder.finalize()
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key[:32]), modes.CBC(iv)).encryptor()
+    data = encryptor.update(padded) + encryptor.finalize()
+    mac = hmac.new(key[32:64], iv + data, hashlib.sha256).digest()
+    return iv, data, mac
+
+
+def enc_string(key, plain):
+    if isinstance(plain, str):
+        plain = plain.encode("utf-8")
+    iv, data, mac = aes_encrypt(key, plain)
+    return "2." + "|".join(base64.b64encode(p).decode("ascii") for p in (iv, data, mac))
+
+
+def protected(plain):
+    """ EncArrayBuffer: type byte, IV, MAC, data """
+    iv, data, mac = aes_encrypt(SESSION_KEY, plain)
+    return base64.b64encode(bytes([2]) + iv + mac + data).decode("ascii")
+
+
+def ciphers(private_key):
+    user, org = USER_KEY, ORG_KEY
+    login = {
+        "id": "c1000000-0000-4000-8000-000000000001",
+        "organizationId": None,
+        "folderId": FOLDER_ID,
+        "collectionIds": [],
+        "type": 1,
+        "name": enc_string(user, "GitHub"),
+        "notes": enc_string(user, "Recovery codes\nin the safe"),
+        "favorite": False,
+        "reprompt": 0,
+        "login": {
+            "username": enc_string(user, "alice@example.com"),
+            "password": enc_string(user, "correct horse battery staple"),
+            "totp": enc_string(user, "JBSWY3DPEHPK3PXP"),
+            "uris": [{"uri": enc_string(user, "https://github.com/login"), "match": None}],
+            "passwordRevisionDate": None,
+        },
+        "fields": [
+            {"type": 0, "name": enc_string(user, "PIN"), "value": enc_string(user, "1234"), "linkedId": None},
+            {"type": 1, "name": enc_string(user, "API token"), "value": enc_string(user, "ghp_secret"),
+             "linkedId": None},
+        ],
+        "revisionDate": "2024-05-01T10:00:00.000Z",
+        "creationDate": "2024-05-01T10:00:00.000Z",
+        "deletedDate": None,
+        "key": None,
+    }
+    card = {
+        "id": "c1000000-0000-4000-8000-000000000002",
+        "organizationId": None,
+        "folderId": None,
+        "collectionIds": [],
+        "type": 3,
+        "name": enc_string(ITEM_KEY, "Visa"),
+        "notes": None,
+        "card": {
+            "cardholderName": enc_string(ITEM_KEY, "Alice Example"),
+            "brand": enc_string(ITEM_KEY, "Visa"),
+            "number": enc_string(ITEM_KEY, "4111111111111111"),
+            "expMonth": enc_string(ITEM_KEY, "4"),
+            "expYear": enc_string(ITEM_KEY, "2030"),
+            "code": enc_string(ITEM_KEY, "123"),
+        },
+        "revisionDate": "2024-05-02T10:00:00.000Z",
+        "creationDate": "2024-05-02T10:00:00.000Z",
+        "deletedDate": None,
+        # Newer clients encrypt every item with its own key
+        "key": enc_string(user, ITEM_KEY),
+    }
+    org_login = {
+        "id": "c1000000-0000-4000-8000-000000000003",
+        "organizationId": ORG_ID,
+        "folderId": None,
+        "collectionIds": [COLLECTION_ID],
+        "type": 1,
+        "name": enc_string(org, "Payroll"),
+        "notes": None,
+        "login": {
+            "username": enc_string(org, "finance@acme.example"),
+            "password": enc_string(org, "org-password"),
+            "totp": None,
+            "uris": [{"uri": enc_string(org, "payroll.acme.example"), "match": 1}],
+        },
+        "revisionDate": "2024-05-03T10:00:00.000Z",
+        "creationDate": "2024-05-03T10:00:00.000Z",
+        "deletedDate": None,
+        "key": None,
+    }
+    deleted = {
+        "id": "c1000000-0000-4000-8000-000000000004",
+        "organizationId": None,
+        "folderId": None,
+        "collectionIds": [],
+        "type": 2,
+        "name": enc_string(user, "Old note"),
+        "notes": enc_string(user, "In the trash"),
+        "secureNote": {"type": 0},
+        "revisionDate": "2024-05-04T10:00:00.000Z",
+        "creationDate": "2024-05-04T10:00:00.000Z",
+        "deletedDate": "2024-05-05T10:00:00.000Z",
+        "key": None,
+    }
+    return {c["id"]: c for c in (login, card, org_login, deleted)}
+
+
+def objects(private_key):
+    public_key = private_key.public_key()
+    org_key = "4." + base64.b64encode(public_key.encrypt(
+        ORG_KEY, rsa_padding.OAEP(mgf=rsa_padding.MGF1(algorithm=hashes.SHA1()), algorithm=hashes.SHA1(), label=None)
+    )).decode("ascii")
+    der = private_key.private_bytes(
+        serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return {
+        "ciphers": ciphers(private_key),
+        "folders": {FOLDER_ID: {"id": FOLDER_ID, "name": enc_string(USER_KEY, "Work"),
+                                "revisionDate": "2024-05-01T10:00:00.000Z"}},
+        "collections": {COLLECTION_ID: {"id": COLLECTION_ID, "organizationId": ORG_ID,
+                                        "name": enc_string(ORG_KEY, "Finance"), "externalId": None,
+                                        "readOnly": False}},
+        "organizations": {ORG_ID: {"id": ORG_ID, "name": "Acme", "enabled": True}},
+        "org_keys": {ORG_ID: {"type": "organization", "key": org_key}},
+        "private_key": enc_string(USER_KEY, der),
+    }
+
+
+def flat_layout(o):
+    def key(name):
+        return "user_{}_{}".format(USER_ID, name)
+
+    return {
+        "global_account_activeAccountId": USER_ID,
+        "global_account_accounts": {USER_ID: {"name": "Alice", "email": "alice@example.com",
+                                              "emailVerified": True}},
+        key("ciphers_ciphers"): o["ciphers"],
+        key("folder_folders"): o["folders"],
+        key("collection_collections"): o["collections"],
+        key("organizations_organizations"): o["organizations"],
+        key("crypto_organizationKeys"): o["org_keys"],
+        key("crypto_privateKey"): o["private_key"],
+        "__PROTECTED__{}_user_auto".format(USER_ID): protected(USER_KEY),
+    }
+
+
+def account_layout(o):
+    stretched = SymmetricKey.stretch(MASTER_KEY)
+    return {
+        "activeUserId": USER_ID,
+        "authenticatedAccounts": [USER_ID],
+        USER_ID: {
+            "data": {
+                "ciphers": {"encrypted": o["ciphers"]},
+                "folders": {"encrypted": o["folders"]},
+                "collections": {"encrypted": o["collections"]},
+                "organizations": o["organizations"],
+            },
+            "keys": {
+                "cryptoSymmetricKey": {"encrypted": enc_string(stretched.enc_key + stretched.mac_key, USER_KEY)},
+                "organizationKeys": {"encrypted": o["org_keys"]},
+                "privateKey": {"encrypted": o["private_key"]},
+            },
+            "profile": {"userId": USER_ID, "email": "alice@example.com"},
+        },
+        "__PROTECTED__{}_masterkey_auto".format(USER_ID): protected(MASTER_KEY),
+    }
+
+
+def main():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    o = objects(private_key)
+    for name, data in (("flat.json", flat_layout(o)), ("account.json", account_layout(o))):
+        with open(os.path.join(FIXTURES_DIR, name), "w") as f:
+            json.dump(data, f, indent=2)
+    with open(os.path.join(FIXTURES_DIR, "session.txt"), "w") as f:
+        f.write(base64.b64encode(SESSION_KEY).decode("ascii") + "\n")
+
+
+if __name__ == "__main__":
+    main()
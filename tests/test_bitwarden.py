@@ -0,0 +1,44 @@
+import unittest
+from datetime import datetime, timedelta
+
+from accounts import AccountManager
+from bitwarden import BitwardenClient
+
+
+class LockListenerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = BitwardenClient()
+        self.calls = []
+        self.client.add_lock_listener(lambda: self.calls.append("locked"))
+
+    def test_clear_secrets(self):
+        self.client.session = "session"
+        self.client.clear_secrets()
+        self.assertIsNone(self.client.session)
+        self.assertEqual(["locked"], self.calls)
+
+    def test_expired_session(self):
+        self.client.session = "session"
+        self.client.inactivity_lock_timeout = 60
+        self.client.passphrase_expires_at = datetime.now() - timedelta(seconds=1)
+        self.assertTrue(self.client.expire_session())
+        self.assertIsNone(self.client.session)
+        self.assertEqual(["locked"], self.calls)
+
+    def test_session_not_expired(self):
+        self.client.session = "session"
+        self.client.inactivity_lock_timeout = 60
+        self.client.passphrase_expires_at = datetime.now() + timedelta(seconds=60)
+        self.assertFalse(self.client.expire_session())
+        self.assertEqual([], self.calls)
+
+    def test_additional_accounts_share_listeners(self):
+        accounts = AccountManager(self.client)
+        accounts.configure("work,alice@example.com,https://vault.example.com")
+        accounts.get("work").clear_secrets()
+        self.assertEqual(["locked"], self.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import json
+import socket
+import subprocess
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import bitwarden_serve
+from bitwarden import BitwardenClient
+from bitwarden_serve import BitwardenServe, BitwardenServeError, die_with_parent, route
+
+
+class FakeProcess:
+    """ Stands in for the `bw serve` process, the HTTP server answers in its place """
+
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Answers like the REST API of `bw serve` """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        if self.path.startswith("/list/object/items"):
+            self.respond({"success": True, "data": {"object": "list", "data": [{"id": "1", "name": "GitHub"}]}})
+        else:
+            self.respond({"success": False, "message": "Not found."})
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        self.respond({"success": True, "data": {"object": "message", "title": "Done"}})
+
+    def respond(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connections are reset on purpose when the server "dies"
+        pass
+
+
+class RouteTest(unittest.TestCase):
+
+    def test_list_items(self):
+        self.assertEqual(route(["list", "items"]), ("GET", "/list/object/items"))
+
+    def test_search_is_url_encoded(self):
+        self.assertEqual(route(["list", "items", "--search", "a b&c"]), ("GET", "/list/object/items?search=a+b%26c"))
+
+    def test_url(self):
+        self.assertEqual(
+            route(["list", "items", "--url", "https://github.com/login"]),
+            ("GET", "/list/object/items?url=https%3A%2F%2Fgithub.com%2Flogin"),
+        )
+
+    def test_objects(self):
+        for name in ("folders", "collections", "organizations"):
+            self.assertEqual(route(["list", name]), ("GET", "/list/object/" + name))
+
+    def test_get_item_and_totp(self):
+        self.assertEqual(route(["get", "item", "a/b"]), ("GET", "/object/item/a%2Fb"))
+        self.assertEqual(route(["get", "totp", "id"]), ("GET", "/object/totp/id"))
+
+    def test_sync_and_lock(self):
+        self.assertEqual(route(["sync"]), ("POST", "/sync"))
+        self.assertEqual(route(["lock"]), ("POST", "/lock"))
+
+    def test_unsupported_commands(self):
+        self.assertIsNone(route(["unlock", "--raw"]))
+        self.assertIsNone(route(["list", "items", "--folderid", "x"]))
+        self.assertIsNone(route(["config", "server", "https://example.com"]))
+
+
+class DieWithParentTest(unittest.TestCase):
+    """ die_with_parent() runs between fork and exec, where it must not start processes or load libraries """
+
+    def test_only_calls_prctl(self):
+        libc = mock.Mock()
+        with mock.patch.object(bitwarden_serve, "libc", libc), \
+                mock.patch.object(subprocess, "Popen", side_effect=AssertionError("process started")), \
+                mock.patch("ctypes.CDLL", side_effect=AssertionError("library loaded")):
+            die_with_parent()
+        libc.prctl.assert_called_once_with(bitwarden_serve.PR_SET_PDEATHSIG, bitwarden_serve.signal.SIGTERM)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "PR_SET_PDEATHSIG is Linux only")
+    def test_child_starts(self):
+        result = subprocess.run(["true"], preexec_fn=die_with_parent)
+        self.assertEqual(0, result.returncode)
+
+
+class StandInServerTest(unittest.TestCase):
+    """ Runs a stand-in `bw serve` on localhost for every test """
+
+    def setUp(self):
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        self.server.connections = []
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.serve = BitwardenServe("bw", timeout=5)
+        self.serve.port = self.server.server_address[1]
+        self.serve.process = FakeProcess()
+
+    def tearDown(self):
+        self.serve.stop()
+        self.stop_server()
+
+    def stop_server(self):
+        """ Like a dying server, this also closes the open keep-alive connections """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            for connection in self.server.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.server = None
+
+
+class BitwardenServeTest(StandInServerTest):
+
+    def test_request(self):
+        self.assertTrue(self.serve.is_ready())
+        out = self.serve.request("GET", "/list/object/items?search=git")
+        self.assertTrue(out["success"])
+        self.assertEqual(out["data"]["data"][0]["name"], "GitHub")
+        self.assertEqual(self.server.requests, [("GET", "/list/object/items?search=git")])
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.serve.request(*route(["list", "items"]))
+        self.serve.request(*route(["sync"]))
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_not_ready_when_process_exited(self):
+        self.serve.process.returncode = 1
+        self.assertFalse(self.serve.is_ready())
+
+    def test_request_fails_when_server_died(self):
+        self.serve.request("GET", "/list/object/items")
+        self.stop_server()
+        with self.assertRaises(BitwardenServeError):
+            self.serve.request("GET", "/list/object/items")
+
+
+class ServeFallbackTest(StandInServerTest):
+    """ BitwardenClient uses the server while it answers and falls back to the CLI when it dies """
+
+    def setUp(self):
+        super().setUp()
+        self.client = BitwardenClient()
+        self.client.serve = self.serve
+
+    def test_served(self):
+        out = self.client.run_serve_request("list items", ("list", "items"))
+        self.assertEqual(out["data"]["data"][0]["id"], "1")
+        self.assertIs(self.client.serve, self.serve)
+
+    def test_unrouted_commands_use_the_cli(self):
+        self.assertIsNone(self.client.run_serve_request("unlock", ("unlock", "--raw")))
+        self.assertEqual(self.server.requests, [])
+
+    def test_falls_back_when_server_died(self):
+        self.client.run_serve_request("list items", ("list", "items"))
+        self.stop_server()
+        self.assertIsNone(self.client.run_serve_request("list items", ("list", "items")))
+        self.assertIsNone(self.client.serve)
+        self.assertEqual(self.client.stats.to_dict()["counters"]["serve.list items.errors"], 1)
+        self.assertIsNone(self.serve.process)
+
+
+if __name__ == "__main__":
+    unittest.main()
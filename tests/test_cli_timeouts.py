@@ -0,0 +1,228 @@
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import bitwarden
+from bitwarden import BitwardenCliTimeoutError, BitwardenCliUnavailableError, BitwardenClient, is_transient_failure
+from circuit_breaker import CircuitBreaker
+
+CLI_TIMEOUT = 0.5
+
+# Stands in for bw. Every call is logged, STUB_MODE decides what it does:
+# hang starts a helper process and sleeps past the timeout, transient fails
+# like Node.js does without network, anything else succeeds.
+STUB_BW = """#!/bin/sh
+echo "$*" >> "$STUB_DIR/calls"
+case "$STUB_MODE" in
+    hang)
+        sleep 30 > /dev/null 2>&1 &
+        echo $! >> "$STUB_DIR/helpers"
+        exec sleep 30
+        ;;
+    transient)
+        echo "request to https://vault.example.com failed, reason: getaddrinfo EAI_AGAIN" >&2
+        exit 1
+        ;;
+    *)
+        echo '{"success":true,"data":[]}'
+        ;;
+esac
+"""
+
+
+def is_running(pid):
+    """ Killed helpers may be left as zombies until their new parent reaps them """
+    try:
+        with open("/proc/{}/stat".format(pid), "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+def still_running(pids, wait=1):
+    """ The pids still running after waiting a moment for SIGKILL to take effect """
+    deadline = time.monotonic() + wait
+    while True:
+        running = [pid for pid in pids if is_running(pid)]
+        if not running or time.monotonic() >= deadline:
+            return running
+        time.sleep(0.01)
+
+
+class StubCliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cli = os.path.join(self.tmp_dir, "bw")
+        with open(self.cli, "w") as f:
+            f.write(STUB_BW)
+        os.chmod(self.cli, os.stat(self.cli).st_mode | stat.S_IXUSR)
+        self.client = BitwardenClient()
+        self.client.cli = self.cli
+        self.client.cli_timeouts = dict.fromkeys(self.client.cli_timeouts, CLI_TIMEOUT)
+        patcher = mock.patch.object(bitwarden, "RETRY_DELAY_SECS", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for pid in self.lines("helpers"):
+            try:
+                os.kill(int(pid), 9)
+            except OSError:
+                pass
+        shutil.rmtree(self.tmp_dir)
+
+    def lines(self, name):
+        try:
+            with open(os.path.join(self.tmp_dir, name), "r") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def run_cli(self, mode, *args):
+        env = dict(os.environ, STUB_DIR=self.tmp_dir, STUB_MODE=mode)
+        return self.client.run_timed_process(bitwarden.command_name(args), [self.cli, *args], env=env)
+
+    def timed(self, mode, *args):
+        """ Seconds the call took until it raised """
+        start = time.perf_counter()
+        with self.assertRaises((BitwardenCliTimeoutError, BitwardenCliUnavailableError)):
+            self.run_cli(mode, *args)
+        return time.perf_counter() - start
+
+
+class TimeoutTest(StubCliTest):
+
+    def test_list_is_killed_and_retried_once(self):
+        elapsed = self.timed("hang", "list", "items")
+        self.assertEqual(2, len(self.lines("calls")))
+        self.assertGreaterEqual(elapsed, 2 * CLI_TIMEOUT)
+        self.assertLess(elapsed, 2 * CLI_TIMEOUT + 1)
+
+    def test_process_group_is_killed(self):
+        self.timed("hang", "get", "item", "x")
+        helpers = self.lines("helpers")
+        self.assertEqual(2, len(helpers))
+        self.assertEqual([], still_running([int(pid) for pid in helpers]))
+
+    def test_get_is_retried_once(self):
+        self.timed("hang", "get", "item", "x")
+        self.assertEqual(["get item x", "get item x"], self.lines("calls"))
+
+    def test_login_is_never_retried(self):
+        elapsed = self.timed("hang", "login", "alice@example.com", "--raw")
+        self.assertEqual(1, len(self.lines("calls")))
+        self.assertLess(elapsed, CLI_TIMEOUT + 1)
+        # Waiting for the user's own login doesn't trip the breaker
+        self.assertEqual(0, self.client.breaker.failures)
+
+    def test_transient_failure_is_retried(self):
+        (out, err) = self.run_cli("transient", "list", "items")
+        self.assertIn(b"EAI_AGAIN", err)
+        self.assertEqual(2, len(self.lines("calls")))
+
+    def test_success_is_not_retried(self):
+        (out, err) = self.run_cli("ok", "list", "items")
+        self.assertEqual(b'{"success":true,"data":[]}\n', out)
+        self.assertEqual(1, len(self.lines("calls")))
+
+    def test_breaker_fails_fast(self):
+        # Two failed attempts, then a third that opens the breaker before its retry
+        self.run_cli("transient", "list", "items")
+        self.timed("hang", "list", "items")
+        self.assertEqual(3, len(self.lines("calls")))
+        self.assertTrue(self.client.breaker.is_open())
+
+        elapsed = self.timed("hang", "get", "item", "x")
+        self.assertLess(elapsed, 0.1)
+        self.assertEqual(3, len(self.lines("calls")))
+        with self.assertRaises(BitwardenCliUnavailableError):
+            self.run_cli("ok", "sync")
+
+    def test_login_ignores_open_breaker(self):
+        for _ in range(3):
+            self.client.breaker.record_failure()
+        (out, err) = self.run_cli("ok", "unlock", "--raw")
+        self.assertTrue(out)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("circuit_breaker.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_secs=30)
+
+    def test_opens_after_threshold(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+            self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(30, self.breaker.retry_in())
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_single_trial_after_reset_time(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.is_open())
+
+    def test_failed_trial_opens_again(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(30, self.breaker.retry_in())
+
+    def test_cancelled_trial(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.cancel_trial()
+        self.assertTrue(self.breaker.allow())
+
+
+class TransientFailureTest(unittest.TestCase):
+
+    def test_network_errors(self):
+        for err in (b"Error: read ECONNRESET", b"connect ETIMEDOUT 1.2.3.4:443", b"FetchError: fetch failed"):
+            with self.subTest(err=err):
+                self.assertTrue(is_transient_failure(b"", err))
+
+    def test_error_response(self):
+        out = b'{"success": false, "message": "request failed, reason: socket hang up"}'
+        self.assertTrue(is_transient_failure(out, b""))
+
+    def test_other_errors(self):
+        self.assertFalse(is_transient_failure(b'{"success":false,"message":"Invalid master password."}', b""))
+        self.assertFalse(is_transient_failure(b"", b"You are not logged in."))
+
+    def test_item_data_is_not_searched(self):
+        out = b'{"success":true,"data":{"notes":"ECONNRESET"}}'
+        self.assertFalse(is_transient_failure(out, b""))
+        big = b'{"success":false,"data":"' + b"x" * 5000 + b' ECONNRESET"}'
+        self.assertFalse(is_transient_failure(big, b""))
+
+
+if __name__ == "__main__":
+    unittest.main()
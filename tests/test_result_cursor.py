@@ -0,0 +1,87 @@
+import unittest
+
+from accounts import AccountMatches, RankedResults
+from bitwarden import ScoredMatches
+from result_cursor import ResultCursor
+from vault_index import VaultEntry, VaultIndex
+
+
+def item(idx, name):
+    return {"id": "item-{}".format(idx), "name": name, "type": 1, "login": {"username": "user{}".format(idx)}}
+
+
+class CountingMatches(ScoredMatches):
+    """ Records how far the matches were ranked """
+
+    def __init__(self, index, totals):
+        super(CountingMatches, self).__init__(index, totals)
+        self.limits = []
+
+    def top(self, limit):
+        self.limits.append(limit)
+        return super(CountingMatches, self).top(limit)
+
+
+class ResultCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        items = [item(idx, "github {}".format("x" * idx)) for idx in range(10)]
+        self.index = VaultIndex.build(items, {})
+        self.totals = self.index.match("github")[0]
+        self.all_ids = [r.entry.id for r in AccountMatches([("", ScoredMatches(self.index, self.totals))]).top(10)]
+
+    def cursor(self, page_size=3):
+        matches = AccountMatches([("", CountingMatches(self.index, self.totals))])
+        return ResultCursor("bw", matches, matches.top(page_size))
+
+    def test_pages_rank_the_kept_matches(self):
+        cursor = self.cursor()
+        ids = []
+        for offset in range(0, 10, 3):
+            (total, results) = cursor.page(offset, 3)
+            self.assertEqual(10, total)
+            ids.extend(r.entry.id for r in results)
+        self.assertEqual(self.all_ids, ids)
+
+    def test_ranks_all_matches_once(self):
+        cursor = self.cursor()
+        matches = cursor.matches.matches[0][1]
+        self.assertEqual([3], matches.limits)
+        cursor.page(0, 3)
+        self.assertEqual([3], matches.limits)
+        cursor.page(3, 3)
+        cursor.page(6, 3)
+        cursor.page(9, 3)
+        self.assertEqual([3, 10], matches.limits)
+
+    def test_results_of_the_cli(self):
+        entries = [VaultEntry.from_item(item(idx, "entry {}".format(idx))) for idx in range(5)]
+        matches = AccountMatches([("work", ScoredMatches(entries=entries))])
+        cursor = ResultCursor("bw", matches, matches.top(2))
+        self.assertEqual(["item-2", "item-3"], [r.entry.id for r in cursor.page(2, 2)[1]])
+        self.assertEqual("work", cursor.page(4, 2)[1][0].account)
+
+    def test_ranked_results(self):
+        cursor = ResultCursor("bw", RankedResults(list("abcde")), list("ab"))
+        self.assertEqual((5, ["c", "d"]), cursor.page(2, 2))
+
+
+class AccountMatchesTest(unittest.TestCase):
+
+    def test_merges_accounts(self):
+        index = VaultIndex.build([item(0, "github"), item(1, "gitlab github")], {})
+        work = ScoredMatches(index, {0: 10, 1: 5})
+        home = ScoredMatches(entries=[VaultEntry.from_item(item(2, "github home"))])
+        matches = AccountMatches([("work", work), ("home", home)])
+        self.assertEqual(3, matches.total)
+        self.assertEqual([("work", "item-0"), ("work", "item-1"), ("home", "item-2")],
+                         [(r.account, r.entry.id) for r in matches.top(3)])
+        self.assertEqual(1, len(matches.top(1)))
+
+    def test_no_matches(self):
+        self.assertEqual(0, ScoredMatches().total)
+        self.assertEqual([], AccountMatches([("", ScoredMatches())]).top(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
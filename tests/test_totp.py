@@ -0,0 +1,115 @@
+import base64
+import unittest
+
+from totp import STEAM_ALPHABET, TotpError, TotpSpec, generate_totp, parse_totp
+
+SHA1_SEED = b"12345678901234567890"
+SHA256_SEED = b"12345678901234567890123456789012"
+SHA512_SEED = b"1234567890123456789012345678901234567890123456789012345678901234"
+
+# RFC 6238 appendix B: (time, SHA1, SHA256, SHA512)
+RFC_6238_VECTORS = [
+    (59, "94287082", "46119246", "90693936"),
+    (1111111109, "07081804", "68084774", "25091201"),
+    (1111111111, "14050471", "67062674", "99943326"),
+    (1234567890, "89005924", "91819424", "93441116"),
+    (2000000000, "69279037", "90698825", "38618901"),
+    (20000000000, "65353130", "77737706", "47863826"),
+]
+
+
+def b32(seed):
+    return base64.b32encode(seed).decode("ascii")
+
+
+class GenerateTotpTest(unittest.TestCase):
+
+    def test_rfc_6238_vectors(self):
+        for (at, sha1, sha256, sha512) in RFC_6238_VECTORS:
+            for (algorithm, seed, expected) in (("SHA1", SHA1_SEED, sha1), ("SHA256", SHA256_SEED, sha256),
+                                                ("SHA512", SHA512_SEED, sha512)):
+                with self.subTest(at=at, algorithm=algorithm):
+                    spec = TotpSpec(seed, algorithm, 8, 30, False)
+                    self.assertEqual(expected, generate_totp(spec, at)[0])
+
+    def test_rfc_6238_vectors_from_uri(self):
+        spec = parse_totp("otpauth://totp/Example:alice?secret={}&algorithm=sha256&digits=8".format(b32(SHA256_SEED)))
+        self.assertEqual("91819424", generate_totp(spec, 1234567890)[0])
+
+    def test_six_digits(self):
+        self.assertEqual("287082", generate_totp(parse_totp(b32(SHA1_SEED)), 59)[0])
+
+    def test_seconds_remaining(self):
+        spec = parse_totp(b32(SHA1_SEED))
+        self.assertEqual(30, generate_totp(spec, 60)[1])
+        self.assertEqual(1, generate_totp(spec, 59)[1])
+        self.assertEqual(29, generate_totp(spec, 1111111111)[1])
+
+    def test_seconds_remaining_with_period(self):
+        spec = parse_totp("otpauth://totp/x?secret={}&period=60".format(b32(SHA1_SEED)))
+        self.assertEqual(60, generate_totp(spec, 120)[1])
+        self.assertEqual(1, generate_totp(spec, 119)[1])
+
+    def test_steam_code(self):
+        (code, _) = generate_totp(parse_totp("steam://" + b32(SHA1_SEED)), 59)
+        self.assertEqual(5, len(code))
+        self.assertTrue(set(code) <= set(STEAM_ALPHABET))
+
+
+class ParseTotpTest(unittest.TestCase):
+
+    def test_plain_secret(self):
+        spec = parse_totp(" jbsw y3dp-ehpk 3pxp ")
+        self.assertEqual(TotpSpec(b"Hello!\xde\xad\xbe\xef", "SHA1", 6, 30, False), spec)
+
+    def test_otpauth_parameters(self):
+        spec = parse_totp("otpauth://totp/ACME:alice?secret=JBSWY3DPEHPK3PXP&issuer=ACME&Algorithm=SHA512"
+                          "&digits=8&period=60")
+        self.assertEqual(TotpSpec(b"Hello!\xde\xad\xbe\xef", "SHA512", 8, 60, False), spec)
+
+    def test_otpauth_defaults(self):
+        spec = parse_totp("otpauth://totp/alice?secret=JBSWY3DPEHPK3PXP")
+        self.assertEqual(("SHA1", 6, 30, False), (spec.algorithm, spec.digits, spec.period, spec.steam))
+
+    def test_lower_case_algorithm(self):
+        self.assertEqual("SHA256", parse_totp("otpauth://totp/x?secret=JBSWY3DPEHPK3PXP&algorithm=sha256").algorithm)
+
+    def test_steam_uri(self):
+        spec = parse_totp("steam://JBSWY3DPEHPK3PXP")
+        self.assertEqual(TotpSpec(b"Hello!\xde\xad\xbe\xef", "SHA1", 5, 30, True), spec)
+
+    def test_steam_encoder(self):
+        spec = parse_totp("otpauth://totp/Steam:alice?secret=JBSWY3DPEHPK3PXP&encoder=steam&digits=8")
+        self.assertTrue(spec.steam)
+        self.assertEqual(5, spec.digits)
+
+    def test_invalid_secret(self):
+        for value in ("not base32!", "otpauth://totp/x?secret=1111"):
+            with self.subTest(value=value):
+                with self.assertRaises(TotpError):
+                    parse_totp(value)
+
+    def test_invalid_period(self):
+        for period in ("0", "-30", "soon"):
+            with self.subTest(period=period):
+                with self.assertRaises(TotpError):
+                    parse_totp("otpauth://totp/x?secret=JBSWY3DPEHPK3PXP&period=" + period)
+
+    def test_invalid_digits(self):
+        with self.assertRaises(TotpError):
+            parse_totp("otpauth://totp/x?secret=JBSWY3DPEHPK3PXP&digits=12")
+
+    def test_missing_secret(self):
+        with self.assertRaises(TotpError):
+            parse_totp("otpauth://totp/x?issuer=ACME")
+
+    def test_unsupported_type_and_algorithm(self):
+        for value in ("otpauth://hotp/x?secret=JBSWY3DPEHPK3PXP&counter=1",
+                      "otpauth://totp/x?secret=JBSWY3DPEHPK3PXP&algorithm=MD5"):
+            with self.subTest(value=value):
+                with self.assertRaises(TotpError):
+                    parse_totp(value)
+
+
+if __name__ == "__main__":
+    unittest.main()
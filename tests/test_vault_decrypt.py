@@ -0,0 +1,235 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import vault_decrypt
+from bitwarden import BitwardenClient
+from vault_decrypt import (LocalVault, SymmetricKey, UnsupportedVaultError, VaultDecryptError, decrypt_enc_string,
+                           is_available)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+LOGIN_ID = "c1000000-0000-4000-8000-000000000001"
+CARD_ID = "c1000000-0000-4000-8000-000000000002"
+ORG_LOGIN_ID = "c1000000-0000-4000-8000-000000000003"
+DELETED_ID = "c1000000-0000-4000-8000-000000000004"
+ORG_ID = "0f4c7d52-9a61-4a55-8d7b-6e5b3c2a0002"
+FOLDER_ID = "5d2d1f8e-1b7c-4f0a-9c3e-2a9b8c7d0003"
+COLLECTION_ID = "a3e1c4b2-6d5f-4e7a-8b9c-0d1e2f3a0004"
+
+
+def read_session():
+    with open(os.path.join(FIXTURES_DIR, "session.txt"), "r") as f:
+        return f.read().strip()
+
+
+@unittest.skipUnless(is_available(), "the cryptography package is not installed")
+class FlatLayoutTest(unittest.TestCase):
+    """ Decrypts fixtures/flat.json, see fixtures/make_vault_fixtures.py """
+
+    fixture = "flat.json"
+
+    def setUp(self):
+        self.vault = LocalVault(os.path.join(FIXTURES_DIR, self.fixture), read_session())
+        self.vault.load()
+
+    def test_names(self):
+        items = {i["id"]: self.vault.searchable_item(i) for i in self.vault.list_items()}
+        self.assertEqual({LOGIN_ID: "GitHub", CARD_ID: "Visa", ORG_LOGIN_ID: "Payroll"},
+                         {item_id: item["name"] for item_id, item in items.items()})
+        self.assertEqual("alice@example.com", items[LOGIN_ID]["login"]["username"])
+        self.assertEqual([{"uri": "https://github.com/login", "match": None}], items[LOGIN_ID]["login"]["uris"])
+        self.assertEqual("Recovery codes\nin the safe", items[LOGIN_ID]["notes"])
+        self.assertNotIn("password", items[LOGIN_ID]["login"])
+        self.assertEqual([{"id": FOLDER_ID, "name": "Work"}], self.vault.list_folders())
+        self.assertEqual([{"id": ORG_ID, "name": "Acme"}], self.vault.list_organizations())
+
+    def test_full_item(self):
+        item = self.vault.get_item(LOGIN_ID)
+        self.assertEqual("item", item["object"])
+        self.assertEqual(LOGIN_ID, item["id"])
+        self.assertEqual(FOLDER_ID, item["folderId"])
+        self.assertEqual("2024-05-01T10:00:00.000Z", item["revisionDate"])
+        self.assertEqual("correct horse battery staple", item["login"]["password"])
+        self.assertEqual("JBSWY3DPEHPK3PXP", item["login"]["totp"])
+        self.assertEqual([("PIN", "1234"), ("API token", "ghp_secret")],
+                         [(f["name"], f["value"]) for f in item["fields"]])
+
+    def test_item_with_own_key(self):
+        card = self.vault.get_item(CARD_ID)["card"]
+        self.assertEqual("4111111111111111", card["number"])
+        self.assertEqual("123", card["code"])
+
+    def test_org_item(self):
+        item = self.vault.get_item(ORG_LOGIN_ID)
+        self.assertEqual("Payroll", item["name"])
+        self.assertEqual("org-password", item["login"]["password"])
+        self.assertEqual([COLLECTION_ID], item["collectionIds"])
+        self.assertEqual([{"id": COLLECTION_ID, "name": "Finance"}], self.vault.list_collections())
+
+    def test_deleted_items_are_left_out(self):
+        self.assertNotIn(DELETED_ID, [i["id"] for i in self.vault.list_items()])
+
+    def test_unknown_item(self):
+        with self.assertRaises(VaultDecryptError):
+            self.vault.get_item("c1000000-0000-4000-8000-999999999999")
+
+
+class AccountLayoutTest(FlatLayoutTest):
+    """ Decrypts fixtures/account.json, whose user key is encrypted with the master key """
+
+    fixture = "account.json"
+
+
+@unittest.skipUnless(is_available(), "the cryptography package is not installed")
+class UnsupportedVaultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(FIXTURES_DIR, "flat.json"), "r") as f:
+            self.data = json.load(f)
+        self.user_id = self.data["global_account_activeAccountId"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, data, session=None):
+        path = os.path.join(self.tmp_dir, "data.json")
+        with open(path, "w") as f:
+            json.dump(data, f)
+        vault = LocalVault(path, session or read_session())
+        vault.load()
+        return vault
+
+    def test_unknown_layout(self):
+        with self.assertRaises(UnsupportedVaultError):
+            self.load({"global_account_activeAccountId": self.user_id, "ciphers": {}})
+
+    def test_no_active_account(self):
+        del self.data["global_account_activeAccountId"]
+        with self.assertRaises(UnsupportedVaultError):
+            self.load(self.data)
+
+    def test_not_json(self):
+        path = os.path.join(self.tmp_dir, "data.json")
+        with open(path, "w") as f:
+            f.write("not json")
+        with self.assertRaises(UnsupportedVaultError):
+            LocalVault(path, read_session()).load()
+
+    def test_no_protected_user_key(self):
+        del self.data["__PROTECTED__{}_user_auto".format(self.user_id)]
+        with self.assertRaises(UnsupportedVaultError):
+            self.load(self.data)
+
+    def test_unexpected_session_key(self):
+        with self.assertRaises(UnsupportedVaultError):
+            self.load(self.data, session=base64.b64encode(b"\0" * 16).decode("ascii"))
+
+    def test_wrong_session_key(self):
+        with self.assertRaises(VaultDecryptError):
+            self.load(self.data, session=base64.b64encode(b"\0" * 64).decode("ascii"))
+
+    def test_unsupported_enc_string_type(self):
+        cipher = self.data["user_{}_ciphers_ciphers".format(self.user_id)][LOGIN_ID]
+        cipher["login"]["password"] = "1." + cipher["login"]["password"][2:]
+        vault = self.load(self.data)
+        with self.assertRaises(UnsupportedVaultError):
+            vault.get_item(LOGIN_ID)
+
+    def test_unsupported_organization_key_type(self):
+        org_keys = self.data["user_{}_crypto_organizationKeys".format(self.user_id)]
+        org_keys[ORG_ID]["key"] = "6." + org_keys[ORG_ID]["key"][2:]
+        vault = self.load(self.data)
+        with self.assertRaises(UnsupportedVaultError):
+            vault.get_item(ORG_LOGIN_ID)
+
+    def test_unsupported_key_length(self):
+        with self.assertRaises(UnsupportedVaultError):
+            SymmetricKey.from_bytes(b"\0" * 48)
+
+    def test_tampered_value(self):
+        cipher = self.data["user_{}_ciphers_ciphers".format(self.user_id)][LOGIN_ID]
+        (iv, data, mac) = cipher["name"][2:].split("|")
+        cipher["name"] = "2." + "|".join((iv, base64.b64encode(b"\0" * 16).decode("ascii"), mac))
+        vault = self.load(self.data)
+        with self.assertRaises(VaultDecryptError):
+            vault.get_item(LOGIN_ID)
+
+
+@unittest.skipUnless(is_available(), "the cryptography package is not installed")
+class EncStringTest(unittest.TestCase):
+
+    def test_type_0_without_mac(self):
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        key = b"k" * 32
+        iv = b"i" * 16
+        padder = padding.PKCS7(128).padder()
+        encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        data = encryptor.update(padder.update(b"legacy") + padder.finalize()) + encryptor.finalize()
+        value = "0.{}|{}".format(base64.b64encode(iv).decode("ascii"), base64.b64encode(data).decode("ascii"))
+        self.assertEqual(b"legacy", decrypt_enc_string(value, SymmetricKey.from_bytes(key)))
+
+    def test_missing_type(self):
+        with self.assertRaises(UnsupportedVaultError):
+            decrypt_enc_string("no type", SymmetricKey.from_bytes(b"k" * 64))
+
+
+class StubSnapshotLoader:
+    """ Stands in for reading the snapshot through the CLI """
+
+    def __init__(self):
+        self.loads = 0
+
+    def load(self, previous):
+        self.loads += 1
+        return "cli snapshot"
+
+
+class NativeSnapshotTest(unittest.TestCase):
+    """ BitwardenClient reads data.json when native_enabled and falls back to the CLI """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        shutil.copy(os.path.join(FIXTURES_DIR, "flat.json"), os.path.join(self.tmp_dir, "data.json"))
+        self.client = BitwardenClient(appdata_dir=self.tmp_dir)
+        self.client.native_enabled = True
+        self.client.session = read_session()
+        self.client.snapshot_loader = StubSnapshotLoader()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @unittest.skipUnless(is_available(), "the cryptography package is not installed")
+    def test_reads_data_json(self):
+        self.assertTrue(self.client.load_snapshot())
+        self.assertEqual(0, self.client.snapshot_loader.loads)
+        self.assertIsNotNone(self.client.local_vault)
+
+    def test_falls_back_without_cryptography(self):
+        with mock.patch.object(vault_decrypt, "Cipher", None):
+            self.assertTrue(self.client.load_snapshot())
+        self.assertEqual("cli snapshot", self.client.snapshot)
+        self.assertIsNone(self.client.local_vault)
+
+    def test_enabling_falls_back_without_cryptography(self):
+        self.client.native_enabled = False
+        with mock.patch.object(vault_decrypt, "Cipher", None):
+            self.client.change_native_enabled(True)
+        self.assertEqual("cli snapshot", self.client.snapshot)
+
+    def test_falls_back_on_unknown_layout(self):
+        with open(os.path.join(self.tmp_dir, "data.json"), "w") as f:
+            json.dump({"activeUserId": "nobody"}, f)
+        self.assertTrue(self.client.load_snapshot())
+        self.assertEqual("cli snapshot", self.client.snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import hmac
+import struct
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+STEAM_ALPHABET = "23456789BCDFGHJKMNPQRTVWXY"
+STEAM_DIGITS = 5
+
+ALGORITHMS = {
+    "SHA1": hashlib.sha1,
+    "SHA256": hashlib.sha256,
+    "SHA512": hashlib.sha512,
+}
+
+TotpSpec = namedtuple("TotpSpec", ["key", "algorithm", "digits", "period", "steam"])
+
+
+class TotpError(Exception):
+    """ The TOTP value stored in the vault can't be used to generate codes """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def decode_secret(secret):
+    secret = secret.replace(" ", "").replace("-", "").upper().rstrip("=")
+    try:
+        return base64.b32decode(secret + "=" * (-len(secret) % 8))
+    except ValueError:
+        raise TotpError("Invalid TOTP secret")
+
+
+def parse_totp(value):
+    """
+    Parse the login.totp value of an item. Supported formats are plain
+    base32 secrets, steam://<secret> and otpauth://totp/ URIs with the
+    algorithm, digits, period and encoder=steam parameters.
+    """
+    value = value.strip()
+    if value.lower().startswith("steam://"):
+        return TotpSpec(decode_secret(value[8:]), "SHA1", STEAM_DIGITS, 30, True)
+
+    if not value.lower().startswith("otpauth://"):
+        return TotpSpec(decode_secret(value), "SHA1", 6, 30, False)
+
+    uri = urlsplit(value)
+    if uri.netloc.lower() != "totp":
+        raise TotpError("Unsupported OTP type: {}".format(uri.netloc))
+    params = {k.lower(): v[0] for k, v in parse_qs(uri.query).items()}
+    if "secret" not in params:
+        raise TotpError("TOTP URI has no secret")
+    algorithm = params.get("algorithm", "SHA1").upper()
+    if algorithm not in ALGORITHMS:
+        raise TotpError("Unsupported TOTP algorithm: {}".format(algorithm))
+    steam = params.get("encoder", "").lower() == "steam"
+    try:
+        digits = STEAM_DIGITS if steam else int(params.get("digits", 6))
+        period = int(params.get("period", 30))
+    except ValueError:
+        raise TotpError("Invalid TOTP parameters")
+    if not 1 <= digits <= 10 or period <= 0:
+        raise TotpError("Invalid TOTP parameters")
+    return TotpSpec(decode_secret(params["secret"]), algorithm, digits, period, steam)
+
+
+def hotp(key, counter, digits, algorithm="SHA1", steam=False):
+    """ HOTP value as defined by RFC 4226, or a Steam Guard code """
+    digest = hmac.new(key, struct.pack(">Q", counter), ALGORITHMS[algorithm]).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    if steam:
+        code = ""
+        for _ in range(digits):
+            value, idx = divmod(value, len(STEAM_ALPHABET))
+            code += STEAM_ALPHABET[idx]
+        return code
+    return str(value % 10 ** digits).zfill(digits)
+
+
+def generate_totp(spec, at=None):
+    """
+    RFC 6238 code for the given time (now by default).
+    Returns (code, seconds until the code changes).
+    """
+    if at is None:
+        at = time.time()
+    counter, elapsed = divmod(int(at), spec.period)
+    code = hotp(spec.key, counter, spec.digits, spec.algorithm, spec.steam)
+    return code, spec.period - elapsed
@@ -0,0 +1,154 @@
+import ipaddress
+import re
+import sys
+from urllib.parse import urlsplit
+
+# Match detection types of login URIs, as stored by Bitwarden. None means
+# the default, which is DOMAIN.
+DOMAIN = 0
+HOST = 1
+STARTS_WITH = 2
+EXACT = 3
+REGULAR_EXPRESSION = 4
+NEVER = 5
+
+# More specific rules rank first
+MATCH_SCORES = {EXACT: 4, STARTS_WITH: 3, HOST: 2, DOMAIN: 1, REGULAR_EXPRESSION: 1}
+
+# Public suffixes with more than one label that are common enough to matter.
+# Bitwarden uses the full public suffix list, this keeps the extension free
+# of a dependency at the cost of rare mismatches.
+MULTI_LABEL_SUFFIXES = frozenset((
+    "ac.uk", "co.uk", "gov.uk", "ltd.uk", "me.uk", "net.uk", "org.uk", "plc.uk", "sch.uk",
+    "com.au", "edu.au", "gov.au", "net.au", "org.au", "co.nz", "net.nz", "org.nz", "govt.nz",
+    "ac.jp", "co.jp", "ne.jp", "or.jp", "go.jp", "co.kr", "or.kr", "go.kr",
+    "com.br", "net.br", "org.br", "gov.br", "com.cn", "net.cn", "org.cn", "gov.cn",
+    "com.hk", "com.sg", "com.tw", "com.my", "co.in", "net.in", "org.in", "gov.in",
+    "co.za", "org.za", "co.il", "org.il", "com.mx", "com.ar", "com.tr", "com.pl", "com.ua",
+    "co.id", "co.th", "com.vn", "com.ph", "com.pk", "com.eg", "com.sa", "com.co", "com.pe",
+    "github.io", "gitlab.io", "herokuapp.com", "azurewebsites.net", "cloudfront.net",
+    "blogspot.com", "netlify.app", "vercel.app", "pages.dev", "workers.dev",
+))
+
+regex_cache = dict()
+
+
+def parse_url(uri):
+    """ Returns (url with a scheme, lower-case host[:port], lower-case host) """
+    uri = uri.strip()
+    url = uri if "://" in uri else "https://" + uri
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        port = parts.port
+    except ValueError:
+        return url, "", ""
+    return url, "{}:{}".format(host, port) if port else host, host
+
+
+def registrable_domain(host):
+    """ "mail.google.co.uk" -> "google.co.uk". IP addresses and single labels are returned as they are. """
+    host = host.rstrip(".")
+    if host[-1:].isdigit() or ":" in host:
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+    labels = host.split(".")
+    if len(labels) < 3:
+        return host
+    if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def uri_rules(item):
+    """
+    The URI match rules of an item as (match type, value) pairs: the
+    registrable domain for DOMAIN, host[:port] for HOST and the URI itself
+    for the others. URIs set to never match are left out.
+    """
+    rules = []
+    for uri in (item.get("login") or dict()).get("uris") or []:
+        value = uri.get("uri")
+        match = uri.get("match")
+        if not value or match == NEVER:
+            continue
+        if match is None or match == DOMAIN:
+            domain = registrable_domain(parse_url(value)[2])
+            if domain:
+                rules.append((DOMAIN, sys.intern(domain)))
+        elif match == HOST:
+            host_port = parse_url(value)[1]
+            if host_port:
+                rules.append((HOST, sys.intern(host_port)))
+        elif match in (STARTS_WITH, EXACT):
+            rules.append((match, parse_url(value)[0]))
+        elif match == REGULAR_EXPRESSION:
+            rules.append((match, value))
+    return tuple(rules)
+
+
+def rule_domain(match, value):
+    """ The registrable domain a rule can match at most, None for regular expressions """
+    if match == DOMAIN:
+        return value
+    elif match == HOST:
+        return registrable_domain(value.rsplit(":", 1)[0] if ":" in value else value)
+    elif match in (STARTS_WITH, EXACT):
+        return registrable_domain(parse_url(value)[2])
+    return None
+
+
+def rule_matches(match, value, url, host_port, domain):
+    if match == DOMAIN:
+        return value == domain
+    elif match == HOST:
+        return value == host_port
+    elif match == STARTS_WITH:
+        return url.startswith(value)
+    elif match == EXACT:
+        return url == value
+    elif match == REGULAR_EXPRESSION:
+        regex = regex_cache.get(value)
+        if regex is None:
+            try:
+                regex = re.compile(value, re.IGNORECASE)
+            except re.error:
+                regex = False
+            regex_cache[value] = regex
+        return bool(regex) and regex.search(url) is not None
+    return False
+
+
+class UriIndex:
+    """
+    Reverse index from registrable domain to the URI rules of items on
+    that domain, so that looking up a site only checks the rules that can
+    match it. Regular expressions can match anything and are always checked.
+    """
+
+    def __init__(self, rules_per_item):
+        self.by_domain = dict()
+        self.regexes = []
+        for idx, rules in enumerate(rules_per_item):
+            for match, value in rules:
+                domain = rule_domain(match, value)
+                if domain is None:
+                    self.regexes.append((idx, value))
+                elif domain:
+                    self.by_domain.setdefault(domain, []).append((idx, match, value))
+
+    def lookup(self, site):
+        """ Returns {idx: score} of the items with a URI matching the site, a host or URL """
+        (url, host_port, host) = parse_url(site)
+        domain = registrable_domain(host)
+        matches = dict()
+        candidates = [(idx, REGULAR_EXPRESSION, value) for idx, value in self.regexes]
+        for idx, match, value in self.by_domain.get(domain, []) + candidates if domain else candidates:
+            if rule_matches(match, value, url, host_port, domain):
+                score = MATCH_SCORES[match]
+                if matches.get(idx, 0) < score:
+                    matches[idx] = score
+        return matches
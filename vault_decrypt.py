@@ -0,0 +1,366 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+
+from vault_snapshot import SnapshotLoader
+
+try:
+    from cryptography.hazmat.primitives import padding, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding as rsa_padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import hashes
+except ImportError:
+    Cipher = None
+
+AES_CBC_256_B64 = 0
+AES_CBC_256_HMAC_SHA256_B64 = 2
+RSA_2048_OAEP_SHA256_B64 = 3
+RSA_2048_OAEP_SHA1_B64 = 4
+
+ENC_STRING_RE = re.compile(r"^\d\.[A-Za-z0-9+/=]+(\|[A-Za-z0-9+/=]+)*$")
+
+PROTECTED_PREFIX = "__PROTECTED__"
+
+# Fields of a cipher which are never encrypted, or hold keys decrypted separately
+PLAIN_FIELDS = ("id", "organizationId", "folderId", "collectionIds", "key", "revisionDate",
+                "creationDate", "deletedDate", "url", "size", "sizeName")
+
+
+class VaultDecryptError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
+
+class UnsupportedVaultError(VaultDecryptError):
+    """ The local vault uses a format or cipher we don't read, the CLI has to be used """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def cli_data_file(appdata_dir=None):
+    """ Path of the data.json file the CLI keeps its encrypted vault in """
+    appdata_dir = appdata_dir or os.environ.get("BITWARDENCLI_APPDATA_DIR")
+    if not appdata_dir:
+        config_dir = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+        appdata_dir = os.path.join(config_dir, "Bitwarden CLI")
+    return os.path.join(appdata_dir, "data.json")
+
+
+def is_available():
+    return Cipher is not None
+
+
+class SymmetricKey:
+    """ AES-256 encryption key with an optional HMAC-SHA256 key """
+
+    def __init__(self, enc_key, mac_key=None):
+        self.enc_key = enc_key
+        self.mac_key = mac_key
+
+    @classmethod
+    def from_bytes(cls, raw):
+        if len(raw) == 64:
+            return cls(raw[:32], raw[32:])
+        elif len(raw) == 32:
+            return cls(raw)
+        raise UnsupportedVaultError("Unsupported key length {}".format(len(raw)))
+
+    @classmethod
+    def stretch(cls, master_key):
+        """ Expand a 32 bytes master key into encryption and MAC keys, like the clients do (HKDF-Expand) """
+        return cls(hkdf_expand(master_key, b"enc", 32), hkdf_expand(master_key, b"mac", 32))
+
+
+def hkdf_expand(prk, info, length):
+    okm = b""
+    block = b""
+    counter = 1
+    while len(okm) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        okm += block
+        counter += 1
+    return okm[:length]
+
+
+def aes_decrypt(key, iv, data, mac):
+    if key.mac_key is not None:
+        if mac is None:
+            raise VaultDecryptError("Missing MAC")
+        expected = hmac.new(key.mac_key, iv + data, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, mac):
+            raise VaultDecryptError("MAC mismatch")
+    decryptor = Cipher(algorithms.AES(key.enc_key), modes.CBC(iv)).decryptor()
+    padded = decryptor.update(data) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    try:
+        return unpadder.update(padded) + unpadder.finalize()
+    except ValueError:
+        raise VaultDecryptError("Bad padding")
+
+
+def decrypt_enc_string(value, key):
+    """ Decrypt an EncString like "2.iv|data|mac" with a SymmetricKey, returns bytes """
+    header, sep, body = value.partition(".")
+    if not sep:
+        raise UnsupportedVaultError("EncString without type")
+    try:
+        enc_type = int(header)
+        parts = [base64.b64decode(p) for p in body.split("|")]
+    except ValueError:
+        raise VaultDecryptError("Malformed EncString")
+    if enc_type == AES_CBC_256_HMAC_SHA256_B64 and len(parts) == 3:
+        return aes_decrypt(key, parts[0], parts[1], parts[2])
+    elif enc_type == AES_CBC_256_B64 and len(parts) == 2 and key.mac_key is None:
+        return aes_decrypt(key, parts[0], parts[1], None)
+    raise UnsupportedVaultError("Unsupported EncString type {}".format(enc_type))
+
+
+def decrypt_enc_bytes(raw, key):
+    """ Decrypt an encrypted buffer laid out as type, IV, MAC and data, as used for protected values """
+    if len(raw) < 50 or raw[0] != AES_CBC_256_HMAC_SHA256_B64:
+        raise UnsupportedVaultError("Unsupported protected value")
+    return aes_decrypt(key, raw[1:17], raw[49:], raw[17:49])
+
+
+def rsa_decrypt(value, private_key):
+    header, sep, body = value.partition(".")
+    if header == str(RSA_2048_OAEP_SHA1_B64):
+        algorithm = hashes.SHA1()
+    elif header == str(RSA_2048_OAEP_SHA256_B64):
+        algorithm = hashes.SHA256()
+    else:
+        raise UnsupportedVaultError("Unsupported organization key type {}".format(header))
+    try:
+        return private_key.decrypt(
+            base64.b64decode(body.split("|")[0]),
+            rsa_padding.OAEP(mgf=rsa_padding.MGF1(algorithm=algorithm), algorithm=algorithm, label=None),
+        )
+    except ValueError:
+        raise VaultDecryptError("Cannot decrypt organization key")
+
+
+def unwrap_state(value):
+    """ Some CLI versions keep state values as JSON strings """
+    if isinstance(value, str) and value[:1] in ('"', "{"):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class LocalVault:
+    """
+    The vault the CLI keeps in its data.json, read without starting the CLI.
+
+    The session key encrypts the user key kept by the CLI, which in turn
+    decrypts the items. Only what the search index needs is decrypted when
+    the vault is loaded, everything else when an item is opened. Two layouts
+    of data.json are known: the per-account one of older CLI versions and
+    the flat "user_<id>_..." keys of newer ones. Anything else raises
+    UnsupportedVaultError, so that the caller can use the CLI instead.
+    """
+
+    def __init__(self, path, session):
+        if not is_available():
+            raise UnsupportedVaultError("The cryptography package is not installed")
+        self.path = path
+        self.session = session
+        self.lock = threading.Lock()
+        self.user_key = None
+        self.private_key = None
+        self.org_keys = dict()
+        self.ciphers = dict()
+        self.folders = dict()
+        self.collections = dict()
+        self.organizations = dict()
+        self.encrypted_org_keys = dict()
+        self.encrypted_private_key = None
+        self.encrypted_user_key = None
+
+    def load(self):
+        """ Read data.json and unlock the user key with the session key """
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise UnsupportedVaultError("Cannot read {}: {}".format(self.path, e))
+
+        user_id = unwrap_state(data.get("global_account_activeAccountId") or data.get("activeUserId"))
+        if not isinstance(user_id, str) or not user_id:
+            raise UnsupportedVaultError("No active account")
+        if "user_{}_ciphers_ciphers".format(user_id) in data:
+            self.read_flat_state(data, user_id)
+        elif isinstance(data.get(user_id), dict):
+            self.read_account_state(data, user_id)
+        else:
+            raise UnsupportedVaultError("Unknown data.json layout")
+        self.user_key = self.read_user_key(data, user_id)
+
+    def read_flat_state(self, data, user_id):
+        def state(name):
+            return unwrap_state(data.get("user_{}_{}".format(user_id, name))) or dict()
+
+        self.ciphers = state("ciphers_ciphers")
+        self.folders = state("folder_folders")
+        self.collections = state("collection_collections")
+        self.organizations = state("organizations_organizations")
+        self.encrypted_org_keys = state("crypto_organizationKeys")
+        self.encrypted_private_key = state("crypto_privateKey") or None
+        self.encrypted_user_key = state("masterPassword_masterKeyEncryptedUserKey") or None
+
+    def read_account_state(self, data, user_id):
+        account = data[user_id]
+        account_data = account.get("data") or dict()
+        keys = account.get("keys") or dict()
+
+        def encrypted(section, name):
+            return ((section.get(name) or dict()).get("encrypted")) or dict()
+
+        self.ciphers = encrypted(account_data, "ciphers")
+        self.folders = encrypted(account_data, "folders")
+        self.collections = encrypted(account_data, "collections")
+        self.organizations = account_data.get("organizations") or dict()
+        self.encrypted_org_keys = encrypted(keys, "organizationKeys")
+        self.encrypted_private_key = encrypted(keys, "privateKey") or None
+        self.encrypted_user_key = encrypted(keys, "cryptoSymmetricKey") or None
+
+    def read_user_key(self, data, user_id):
+        try:
+            session_key = SymmetricKey.from_bytes(base64.b64decode(self.session))
+        except ValueError:
+            raise UnsupportedVaultError("Unexpected session key")
+
+        def protected(name):
+            value = data.get(PROTECTED_PREFIX + name)
+            if value is None:
+                return None
+            return decrypt_enc_bytes(base64.b64decode(value), session_key)
+
+        user_key = protected("{}_user_auto".format(user_id))
+        if user_key is not None:
+            return SymmetricKey.from_bytes(user_key)
+        master_key = protected("{}_masterkey_auto".format(user_id)) or protected("{}_key_auto".format(user_id))
+        if master_key is not None and isinstance(self.encrypted_user_key, str):
+            return SymmetricKey.from_bytes(
+                decrypt_enc_string(self.encrypted_user_key, SymmetricKey.stretch(master_key))
+            )
+        raise UnsupportedVaultError("No user key protected by the session key")
+
+    def org_key(self, org_id):
+        with self.lock:
+            key = self.org_keys.get(org_id)
+            if key is not None:
+                return key
+            entry = self.encrypted_org_keys.get(org_id)
+            value = entry.get("key") if isinstance(entry, dict) else entry
+            if not isinstance(value, str):
+                raise UnsupportedVaultError("No key of organization {}".format(org_id))
+            if self.private_key is None:
+                if not isinstance(self.encrypted_private_key, str):
+                    raise UnsupportedVaultError("No private key")
+                der = decrypt_enc_string(self.encrypted_private_key, self.user_key)
+                self.private_key = serialization.load_der_private_key(der, password=None)
+            key = self.org_keys[org_id] = SymmetricKey.from_bytes(rsa_decrypt(value, self.private_key))
+            return key
+
+    def cipher_key(self, cipher):
+        org_id = cipher.get("organizationId")
+        key = self.org_key(org_id) if org_id else self.user_key
+        if cipher.get("key"):
+            key = SymmetricKey.from_bytes(decrypt_enc_string(cipher["key"], key))
+        return key
+
+    def decrypt_text(self, value, key):
+        if not value:
+            return value
+        return decrypt_enc_string(value, key).decode("utf-8")
+
+    def decrypt_value(self, value, key):
+        """ Decrypt all EncStrings found in a (nested) cipher value """
+        if isinstance(value, dict):
+            return {k: v if k in PLAIN_FIELDS else self.decrypt_value(v, key) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self.decrypt_value(v, key) for v in value]
+        elif isinstance(value, str) and ENC_STRING_RE.match(value):
+            return self.decrypt_text(value, key)
+        return value
+
+    def searchable_item(self, cipher):
+        """ The item with only the fields the search index uses decrypted """
+        key = self.cipher_key(cipher)
+        login = cipher.get("login") or dict()
+        return {
+            "id": cipher["id"],
+            "organizationId": cipher.get("organizationId"),
+            "folderId": cipher.get("folderId"),
+            "collectionIds": cipher.get("collectionIds"),
+            "type": cipher.get("type"),
+            "name": self.decrypt_text(cipher.get("name"), key),
+            "notes": self.decrypt_text(cipher.get("notes"), key),
+            "login": {
+                "username": self.decrypt_text(login.get("username"), key),
+                "uris": [{"uri": self.decrypt_text(u.get("uri"), key), "match": u.get("match")}
+                         for u in login.get("uris") or []],
+            },
+            "revisionDate": cipher.get("revisionDate"),
+        }
+
+    def get_item(self, item_id):
+        """ The fully decrypted item, shaped like the output of `bw get item` """
+        cipher = self.ciphers.get(item_id)
+        if cipher is None:
+            raise VaultDecryptError("No item {}".format(item_id))
+        item = self.decrypt_value(cipher, self.cipher_key(cipher))
+        item["object"] = "item"
+        return item
+
+    def list_items(self):
+        """ Raw encrypted items, they carry plain ids and revision dates """
+        return [c for c in self.ciphers.values() if not c.get("deletedDate")]
+
+    def list_folders(self):
+        return [{"id": f["id"], "name": self.decrypt_text(f.get("name"), self.user_key)}
+                for f in self.folders.values()]
+
+    def list_collections(self):
+        collections = []
+        for c in self.collections.values():
+            try:
+                name = self.decrypt_text(c.get("name"), self.org_key(c.get("organizationId")))
+            except VaultDecryptError:
+                continue
+            collections.append({"id": c["id"], "name": name})
+        return collections
+
+    def list_organizations(self):
+        return [{"id": o["id"], "name": o.get("name") or ""} for o in self.organizations.values()]
+
+
+class LocalSnapshotLoader(SnapshotLoader):
+    """ Builds vault snapshots from data.json, decrypting only new and changed items """
+
+    def __init__(self, vault):
+        self.vault = vault
+
+    def fetch_all(self, timings):
+        start = time.perf_counter()
+        self.vault.load()
+        data = {
+            "items": self.vault.list_items(),
+            "folders": self.vault.list_folders(),
+            "collections": self.vault.list_collections(),
+            "organizations": self.vault.list_organizations(),
+        }
+        timings["decrypt"] = time.perf_counter() - start
+        return data
+
+    def searchable(self, items):
+        return [self.vault.searchable_item(cipher) for cipher in items]
@@ -0,0 +1,369 @@
+import heapq
+import re
+import sys
+import unicodedata
+from bisect import bisect_left
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from uri_match import UriIndex, uri_rules
+
+NAME_WEIGHT = 10
+USERNAME_WEIGHT = 6
+HOST_WEIGHT = 4
+FOLDER_WEIGHT = 2
+NOTES_WEIGHT = 1
+
+EXACT_BONUS = 3
+PREFIX_BONUS = 2
+SUBSTRING_BONUS = 1
+FUZZY_BONUS = 0.5
+
+FUZZY_MIN_SIMILARITY = 0.5
+
+TOKEN_SPLIT_RE = re.compile(r"[\W_]+")
+
+FilterPostings = namedtuple(
+    "FilterPostings", ["types", "folders", "organizations", "collections", "usernames", "username_vocabulary"]
+)
+
+
+def normalize(text):
+    """ Case fold and strip diacritics, so that "Zürich" matches "zurich" """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return [t for t in TOKEN_SPLIT_RE.split(normalize(text)) if t]
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def uri_host(uri):
+    if "://" not in uri:
+        uri = "//" + uri
+    try:
+        return urlsplit(uri).hostname or ""
+    except ValueError:
+        return ""
+
+
+class VaultEntry:
+    """
+    Compact record of a vault item, keeping only what search and rendering
+    need. Passwords, notes, fields and history are not kept, and are
+    fetched when the entry is opened.
+    """
+
+    __slots__ = ("id", "name", "folder_id", "organization_id", "collection_ids", "username", "host", "type",
+                 "revision_date")
+
+    def __init__(self, id, name, folder_id, organization_id, collection_ids, username, host, type, revision_date):
+        self.id = id
+        self.name = name
+        self.folder_id = folder_id
+        self.organization_id = organization_id
+        self.collection_ids = collection_ids
+        self.username = username
+        self.host = host
+        self.type = type
+        self.revision_date = revision_date
+
+    @classmethod
+    def from_item(cls, item):
+        login = item.get("login") or {}
+        uris = login.get("uris") or []
+        host = uri_host(uris[0].get("uri") or "") if uris else ""
+        return cls(
+            item["id"],
+            item.get("name") or "",
+            item.get("folderId"),
+            item.get("organizationId"),
+            tuple(item.get("collectionIds") or ()),
+            login.get("username") or "",
+            sys.intern(host),
+            item.get("type"),
+            item.get("revisionDate"),
+        )
+
+
+def weighted_tokens(item):
+    """ Yields (token, weight) pairs for every searchable field of an item, except its folder """
+    login = item.get("login") or {}
+    fields = [
+        (item.get("name") or "", NAME_WEIGHT),
+        (login.get("username") or "", USERNAME_WEIGHT),
+        (item.get("notes") or "", NOTES_WEIGHT),
+    ]
+    for uri in login.get("uris") or []:
+        host = uri_host(uri.get("uri") or "")
+        if host:
+            fields.append((host, HOST_WEIGHT))
+            yield normalize(host), HOST_WEIGHT
+    for text, weight in fields:
+        for token in tokenize(text):
+            yield token, weight
+
+
+def item_tokens(item):
+    """ Tokens of an item, each with the weight of the best field it appears in """
+    best = dict()
+    for token, weight in weighted_tokens(item):
+        if best.get(token, 0) < weight:
+            best[sys.intern(token)] = weight
+    return tuple(best.items())
+
+
+class VaultIndex:
+    """
+    In-memory ranked search index of all vault items, built once after
+    unlock and updated incrementally after sync.
+
+    Every field is split into normalized tokens when the index is built.
+    Postings map each token to the items containing it together with the
+    weight of the best field it appeared in. Query terms are resolved against
+    the (much smaller) token vocabulary: exact and prefix matches through a
+    sorted token list, substring and fuzzy matches through a trigram index
+    of the vocabulary. Only the top results are ordered, using a heap.
+
+    Items are kept as VaultEntry records. Folder tokens are added when the
+    postings are built, so renaming a folder doesn't require the items.
+    The URI match rules of all login URIs are kept too, for site lookups
+    through a UriIndex.
+
+    An index is never modified once built, so it can be searched while a
+    new one is being prepared.
+    """
+
+    def __init__(self, entries, tokens, folders, rules):
+        self.items = entries
+        self.tokens = tokens
+        self.rules = rules
+        self.uri_index = UriIndex(rules)
+        self.filter_postings = None
+        # Frecency keys of the items, set by AccountManager.positions()
+        self.frecency_positions = None
+        folder_tokens = {folder_id: tuple(tokenize(name)) for folder_id, name in folders.items()}
+        self.folder_tokens = folder_tokens
+        self.postings = dict()
+        for idx, pairs in enumerate(tokens):
+            for token, weight in pairs:
+                self.postings.setdefault(token, dict())[idx] = weight
+            for token in folder_tokens.get(entries[idx].folder_id, ()):
+                posting = self.postings.setdefault(token, dict())
+                if posting.get(idx, 0) < FOLDER_WEIGHT:
+                    posting[idx] = FOLDER_WEIGHT
+        self.vocabulary = sorted(self.postings)
+        self.token_trigrams = dict()
+        for token in self.vocabulary:
+            for trigram in trigrams(token):
+                self.token_trigrams.setdefault(trigram, set()).add(token)
+        self.name_lengths = [len(entry.name) for entry in entries]
+
+    @classmethod
+    def build(cls, items, folders):
+        """ Index raw items as returned by `bw list items` """
+        entries = [VaultEntry.from_item(item) for item in items]
+        tokens = [item_tokens(item) for item in items]
+        rules = [uri_rules(item) for item in items]
+        return cls(entries, tokens, folders, rules)
+
+    def apply_changes(self, changed, deleted_ids, folders):
+        """
+        Returns a new index with added/changed raw items replaced and deleted
+        items removed. Unchanged items reuse their records and tokens.
+        """
+        changed_by_id = {item["id"]: item for item in changed}
+        entries = []
+        tokens = []
+        rules = []
+        for entry, pairs, item_rules in zip(self.items, self.tokens, self.rules):
+            if entry.id in deleted_ids:
+                continue
+            item = changed_by_id.pop(entry.id, None)
+            if item is not None:
+                entry = VaultEntry.from_item(item)
+                pairs = item_tokens(item)
+                item_rules = uri_rules(item)
+            entries.append(entry)
+            tokens.append(pairs)
+            rules.append(item_rules)
+        for item in changed_by_id.values():
+            entries.append(VaultEntry.from_item(item))
+            tokens.append(item_tokens(item))
+            rules.append(uri_rules(item))
+        return VaultIndex(entries, tokens, folders, rules)
+
+    def get_filter_postings(self):
+        """
+        Sets of item positions by type, folder, organization, collection and
+        username token, for filtered searches. Built on the first filtered
+        search, since most indexes never need them.
+        """
+        if self.filter_postings is None:
+            postings = FilterPostings(dict(), dict(), dict(), dict(), dict(), None)
+            for idx, entry in enumerate(self.items):
+                postings.types.setdefault(entry.type, set()).add(idx)
+                postings.folders.setdefault(entry.folder_id, set()).add(idx)
+                postings.organizations.setdefault(entry.organization_id, set()).add(idx)
+                for collection_id in entry.collection_ids:
+                    postings.collections.setdefault(collection_id, set()).add(idx)
+                for token in tokenize(entry.username):
+                    postings.usernames.setdefault(token, set()).add(idx)
+            self.filter_postings = postings._replace(username_vocabulary=sorted(postings.usernames))
+        return self.filter_postings
+
+    def username_matches(self, term):
+        """ Positions of items with a username token starting with the term """
+        postings = self.get_filter_postings()
+        vocabulary = postings.username_vocabulary
+        matches = set()
+        for i in range(bisect_left(vocabulary, term), len(vocabulary)):
+            if not vocabulary[i].startswith(term):
+                break
+            matches |= postings.usernames[vocabulary[i]]
+        return matches
+
+    def ids_and_revisions(self):
+        return {entry.id: entry.revision_date for entry in self.items}
+
+    def __len__(self):
+        return len(self.items)
+
+    def prefix_tokens(self, term):
+        start = bisect_left(self.vocabulary, term)
+        for i in range(start, len(self.vocabulary)):
+            token = self.vocabulary[i]
+            if not token.startswith(term):
+                break
+            yield token
+
+    def matching_tokens(self, term):
+        """ Yields (token, bonus) for every vocabulary token matching a query term """
+        seen = set()
+        for token in self.prefix_tokens(term):
+            seen.add(token)
+            yield token, EXACT_BONUS if token == term else PREFIX_BONUS
+
+        term_trigrams = trigrams(term)
+        if not term_trigrams:
+            return
+
+        postings = sorted(
+            (self.token_trigrams.get(t, set()) for t in term_trigrams), key=len
+        )
+        if postings[0]:
+            for token in set.intersection(*postings) - seen:
+                if term in token:
+                    seen.add(token)
+                    yield token, SUBSTRING_BONUS
+
+        if seen:
+            return
+        hits = dict()
+        for posting in postings:
+            for token in posting:
+                hits[token] = hits.get(token, 0) + 1
+        for token, count in hits.items():
+            similarity = count / max(len(term_trigrams), len(token) - 2)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                yield token, FUZZY_BONUS * similarity
+
+    def term_scores(self, term):
+        """ Returns ({idx: score}, whether fuzzy matching was needed) """
+        scores = None
+        fuzzy = False
+        for token, bonus in self.matching_tokens(term):
+            fuzzy = fuzzy or bonus < SUBSTRING_BONUS
+            posting = self.postings[token]
+            if scores is None:
+                scores = {idx: weight * bonus for idx, weight in posting.items()}
+                continue
+            for idx, weight in posting.items():
+                score = weight * bonus
+                if scores.get(idx, 0) < score:
+                    scores[idx] = score
+        return scores or dict(), fuzzy
+
+    def entry_term_score(self, idx, term):
+        """ Score of a single item for a query term, without fuzzy matching """
+        best = 0
+        pairs = self.tokens[idx] + tuple(
+            (token, FOLDER_WEIGHT) for token in self.folder_tokens.get(self.items[idx].folder_id, ())
+        )
+        for token, weight in pairs:
+            if token == term:
+                bonus = EXACT_BONUS
+            elif token.startswith(term):
+                bonus = PREFIX_BONUS
+            elif len(term) >= 3 and term in token:
+                bonus = SUBSTRING_BONUS
+            else:
+                continue
+            best = max(best, weight * bonus)
+        return best
+
+    def match(self, query, candidates=None):
+        """
+        Score all items matching every query term, or only the candidates
+        when given. Returns ({idx: score}, whether fuzzy matching was needed).
+        """
+        terms = tokenize(query)
+        if not terms:
+            return dict(), False
+
+        if candidates is not None:
+            totals = dict()
+            for idx in candidates:
+                total = 0
+                for term in terms:
+                    score = self.entry_term_score(idx, term)
+                    if not score:
+                        break
+                    total += score
+                else:
+                    totals[idx] = total
+            return totals, False
+
+        per_term = [self.term_scores(term) for term in terms]
+        fuzzy = any(f for _, f in per_term)
+        per_term = sorted((scores for scores, _ in per_term), key=len)
+        totals = per_term[0]
+        for scores in per_term[1:]:
+            totals = {idx: s + scores[idx] for idx, s in totals.items() if idx in scores}
+        return totals, fuzzy
+
+    def rank(self, totals, limit=None):
+        """
+        Returns the items of the {idx: score} map, best first. When a limit
+        is given, only the first `limit` items are ordered, the rest follow
+        in no particular order.
+        """
+        def key(idx):
+            return totals[idx], -self.name_lengths[idx]
+
+        if limit is None or limit >= len(totals):
+            ranked = sorted(totals, key=key, reverse=True)
+            return [self.items[idx] for idx in ranked]
+
+        threshold = heapq.nlargest(limit, totals.values())[-1]
+        top = heapq.nlargest(limit, [idx for idx, s in totals.items() if s >= threshold], key=key)
+        top_set = set(top)
+        rest = [self.items[idx] for idx in totals if idx not in top_set]
+        return [self.items[idx] for idx in top] + rest
+
+    def top(self, totals, limit):
+        """ Returns the `limit` best items of the {idx: score} map as (score, item) pairs, best first """
+        top = heapq.nlargest(limit, totals, key=lambda idx: (totals[idx], -self.name_lengths[idx]))
+        return [(totals[idx], self.items[idx]) for idx in top]
+
+    def match_site(self, site):
+        """ Score the items with a login URI matching the site, by how specific the URI's match rule is """
+        return self.uri_index.lookup(site)
+
+    def search(self, query, limit=None):
+        """ Returns all items matching every query term, see rank() """
+        return self.rank(self.match(query)[0], limit)
@@ -0,0 +1,88 @@
+import logging
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from vault_index import VaultIndex
+from vault_sync import diff_items
+
+logger = logging.getLogger(__name__)
+
+VaultSnapshot = namedtuple(
+    "VaultSnapshot", ["index", "folders", "collections", "organizations", "timings"]
+)
+
+OBJECTS = ("items", "folders", "collections", "organizations")
+REQUIRED_OBJECTS = ("items", "folders")
+
+
+class SnapshotLoadError(Exception):
+
+    def __init__(self, message):
+        self.message = message
+
+
+class SnapshotLoader:
+    """
+    Loads everything searches need with concurrent `bw list` calls, and
+    builds an immutable snapshot of it. The time spent in every stage is
+    kept in the snapshot and logged.
+    """
+
+    def __init__(self, run_cli_session):
+        self.run_cli_session = run_cli_session
+
+    def fetch(self, obj):
+        start = time.perf_counter()
+        (err, out) = self.run_cli_session("list", obj)
+        elapsed = time.perf_counter() - start
+        if err or not out or not out["success"]:
+            if obj in REQUIRED_OBJECTS:
+                raise SnapshotLoadError("Cannot list {}".format(obj))
+            return [], elapsed
+        return out["data"]["data"], elapsed
+
+    def fetch_all(self, timings):
+        with ThreadPoolExecutor(max_workers=len(OBJECTS)) as executor:
+            futures = {obj: executor.submit(self.fetch, obj) for obj in OBJECTS}
+            data = dict()
+            for obj, future in futures.items():
+                (data[obj], timings[obj]) = future.result()
+        return data
+
+    def searchable(self, items):
+        """ Items as the search index expects them, `bw list items` already returns them that way """
+        return items
+
+    def load(self, previous=None):
+        """
+        Fetch and index the vault. When a previous snapshot is given, only
+        the differences are applied to its index.
+        """
+        timings = dict()
+        start = time.perf_counter()
+        data = self.fetch_all(timings)
+        timings["fetch"] = time.perf_counter() - start
+
+        index_start = time.perf_counter()
+        folders = {f["id"]: sys.intern(f["name"]) for f in data["folders"]}
+        collections = {c["id"]: c["name"] for c in data["collections"]}
+        organizations = {o["id"]: o["name"] for o in data["organizations"]}
+        if previous is None:
+            index = VaultIndex.build(self.searchable(data["items"]), folders)
+        else:
+            changed, deleted = diff_items(previous.index.ids_and_revisions(), data["items"])
+            if changed or deleted or folders != previous.folders:
+                index = previous.index.apply_changes(self.searchable(changed), deleted, folders)
+            else:
+                index = previous.index
+        timings["index"] = time.perf_counter() - index_start
+        timings["total"] = time.perf_counter() - start
+
+        logger.info(
+            "Vault snapshot with %d items loaded: %s",
+            len(index),
+            ", ".join("{} {:.0f} ms".format(stage, secs * 1000) for stage, secs in timings.items()),
+        )
+        return VaultSnapshot(index, folders, collections, organizations, timings)
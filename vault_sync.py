@@ -0,0 +1,58 @@
+import threading
+
+
+def diff_items(old_revisions, new_items):
+    """
+    Compare the {id: revisionDate} map of the current index with freshly
+    listed items. Returns (added or changed items, deleted ids).
+    """
+    changed = [item for item in new_items if old_revisions.get(item["id"], "") != item.get("revisionDate")]
+    new_ids = {item["id"] for item in new_items}
+    deleted = {item_id for item_id in old_revisions if item_id not in new_ids}
+    return changed, deleted
+
+
+class BackgroundSync:
+    """
+    Runs the sync function on a background thread. Requests made while a
+    sync is already running are merged into it: their callbacks are called
+    when the running sync finishes.
+    """
+
+    def __init__(self, sync_fn):
+        self.sync_fn = sync_fn
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.thread = None
+
+    def is_running(self):
+        with self.lock:
+            return self.thread is not None
+
+    def request(self, callback=None):
+        """
+        Returns True if a new sync was started, False if the request was
+        merged into the running one.
+        """
+        with self.lock:
+            if callback:
+                self.callbacks.append(callback)
+            if self.thread is not None:
+                return False
+            self.thread = threading.Thread(target=self.run, name="bitwarden-sync", daemon=True)
+            self.thread.start()
+            return True
+
+    def run(self):
+        error = None
+        try:
+            success = self.sync_fn()
+        except Exception as e:
+            success = False
+            error = e
+        with self.lock:
+            callbacks = self.callbacks
+            self.callbacks = []
+            self.thread = None
+        for callback in callbacks:
+            callback(success, error)